@@ -1,39 +1,159 @@
-from flask import Flask, render_template, request, Response, session, redirect, url_for, flash, jsonify
-import sqlite3
+from flask import Blueprint, Flask, current_app, render_template, request, Response, session, redirect, url_for, flash, jsonify, g
 import csv
 import io
 import hashlib
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import requests
 import re
+import threading
 import time
+import logging
 from datetime import datetime
+import functools
+import geo
+import metrics
+import storage
+import suppression
+from metrics import log_event
+from schema_parcels import spatial_filter
 
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
-DB_FILE = os.path.join(os.path.dirname(__file__), "contacts.db")
+# smtplib/email.mime (send routes) and profiling (opt-in) are imported lazily to keep worker start-up fast.
 
-# Email configuration - set these in Replit Secrets
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
-EMAIL_ADDRESS = os.environ.get('EMAIL_ADDRESS', '')
-EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD', '')
+DB_FILE = os.path.join(os.path.dirname(__file__), "contacts.db")
 
-def init_users_table():
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute('''
+bp = Blueprint("main", __name__)
+
+def default_config():
+    """App configuration read from the environment (set these in Replit Secrets)"""
+    return {
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'your-secret-key-change-this'),
+        # SQLite path (default) or a postgresql:// URL
+        'DATABASE': os.environ.get('DATABASE_URL') or os.environ.get('DB_FILE', DB_FILE),
+        # Email configuration
+        'SMTP_SERVER': os.environ.get('SMTP_SERVER', "smtp.gmail.com"),
+        'SMTP_PORT': int(os.environ.get('SMTP_PORT', 587)),
+        'SMTP_USE_TLS': os.environ.get('SMTP_USE_TLS', '1') != '0',
+        'SEND_DELAY_SECONDS': float(os.environ.get('SEND_DELAY_SECONDS', 1)),
+        'EMAIL_ADDRESS': os.environ.get('EMAIL_ADDRESS', ''),
+        'EMAIL_PASSWORD': os.environ.get('EMAIL_PASSWORD', ''),
+        'METRICS_TOKEN': os.environ.get('METRICS_TOKEN', ''),
+        # Profiling: PROFILE_DIR turns on profiling of campaign/send jobs; ADMIN_USERS may add ?profile=1 to any request
+        'PROFILE_DIR': os.environ.get('PROFILE_DIR', ''),
+        'PROFILE_MODE': os.environ.get('PROFILE_MODE', 'cprofile'),
+        'ADMIN_USERS': {u.strip() for u in os.environ.get('ADMIN_USERS', '').split(',') if u.strip()},
+    }
+
+def create_app(config=None):
+    """Application factory: build the app, then run schema setup once per database"""
+    app = Flask(__name__)
+    app.config.update(default_config())
+    if config:
+        app.config.update(config)
+    metrics.configure_logging()
+    app.register_blueprint(bp)
+    init_database(app.config['DATABASE'])
+    return app
+
+# One connection per worker thread, reopened after fork so pre-forked workers never share a handle.
+_local = threading.local()
+
+def open_db(target):
+    backend = storage.get_backend(target)
+    conn = backend.connect(timed=True)
+    if backend.name == "sqlite":
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+def get_db():
+    """This worker thread's connection; statements are timed for /metrics and slow-query logs"""
+    target = current_app.config['DATABASE']
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid() or _local.target != target:
+        conn = open_db(target)
+        _local.conn, _local.pid, _local.target = conn, os.getpid(), target
+    return conn
+
+@bp.teardown_app_request
+def release_db(exc):
+    # Never leak a half-finished transaction into the next request on this worker
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid() and conn.in_transaction:
+        conn.rollback()
+
+# Campaign membership is (campaign_id, parcel_rowid) plus per-campaign state; owner, addresses
+# and value are read from `parcels`, so refreshes show through and campaigns copy nothing
+CAMPAIGN_CONTACTS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS campaign_contacts_v2 (
+        campaign_id INTEGER NOT NULL REFERENCES campaigns (id),
+        parcel_rowid INTEGER NOT NULL REFERENCES parcels (id) ON DELETE CASCADE,
+        email TEXT,
+        email_sent BOOLEAN DEFAULT FALSE,
+        letter_generated BOOLEAN DEFAULT FALSE,
+        offer REAL,
+        PRIMARY KEY (campaign_id, parcel_rowid)
+    ) WITHOUT ROWID
+'''
+
+def normalize_campaign_contacts(conn, backend):
+    """Rewrite copied contact rows as references to their parcels.
+
+    County campaigns match on the parcel key. parcel_id is only unique within a county, so
+    area campaigns (no county) also match on the property address and must find exactly one
+    parcel. Rows that match nothing, or more than one parcel, are kept verbatim in
+    campaign_contacts_unmatched rather than dropped.
+    """
+    backend.executescript(conn, backend.ddl(CAMPAIGN_CONTACTS_SCHEMA))
+    conn.execute("DELETE FROM campaign_contacts_v2")  # leftovers from an interrupted attempt
+    conn.execute("DROP TABLE IF EXISTS contact_matches")
+    total = conn.execute("SELECT COUNT(*) FROM campaign_contacts").fetchone()[0]
+    conn.execute("""
+        CREATE TEMP TABLE contact_matches AS
+        SELECT cc.id,
+               -- the first lookup uses the parcel key index; area campaigns have no county
+               COALESCE((SELECT MIN(p.id) FROM parcels p
+                         WHERE p.county = c.county AND p.state = c.state AND p.parcel_id = cc.parcel_id),
+                        (SELECT CASE WHEN COUNT(*) = 1 THEN MIN(p.id) END FROM parcels p
+                         WHERE c.county IS NULL AND p.state = c.state AND p.parcel_id = cc.parcel_id
+                           AND COALESCE(p.situs_address, '') = COALESCE(cc.property_address, ''))
+               ) AS parcel_rowid
+        FROM campaign_contacts cc
+        JOIN campaigns c ON c.id = cc.campaign_id
+    """)
+    conn.execute("""
+        INSERT INTO campaign_contacts_v2 (campaign_id, parcel_rowid, email, email_sent, letter_generated, offer)
+        SELECT cc.campaign_id, m.parcel_rowid, cc.email, cc.email_sent, cc.letter_generated,
+               cc.assessed_value * c.offer_percentage / 100
+        FROM campaign_contacts cc
+        JOIN contact_matches m ON m.id = cc.id
+        JOIN campaigns c ON c.id = cc.campaign_id
+        WHERE m.parcel_rowid IS NOT NULL
+        ORDER BY cc.id
+        ON CONFLICT DO NOTHING
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS campaign_contacts_unmatched AS
+        SELECT cc.* FROM campaign_contacts cc JOIN contact_matches m ON m.id = cc.id
+        WHERE m.parcel_rowid IS NULL
+    """)
+    kept = conn.execute("SELECT COUNT(*) FROM campaign_contacts_v2").fetchone()[0]
+    unmatched = conn.execute("SELECT COUNT(*) FROM campaign_contacts_unmatched").fetchone()[0]
+    conn.execute("DROP TABLE contact_matches")
+    conn.execute("DROP TABLE campaign_contacts")
+    conn.execute("ALTER TABLE campaign_contacts_v2 RENAME TO campaign_contacts")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_campaign_contacts_parcel ON campaign_contacts (parcel_rowid)")
+    log_event("campaign_contacts_normalized", logging.WARNING if unmatched else logging.INFO, rows=total, kept=kept,
+              unmatched=unmatched, duplicates=total - kept - unmatched)
+
+# Applied in order, once per database (see storage.apply_migrations); append new entries, never edit shipped ones
+APP_MIGRATIONS = [
+    ("app_0001_users", '''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE NOT NULL,
             password_hash TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    cur.execute('''
+    '''),
+    ("app_0002_campaigns", '''
         CREATE TABLE IF NOT EXISTS campaigns (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
@@ -47,8 +167,8 @@ def init_users_table():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
-    ''')
-    cur.execute('''
+    '''),
+    ("app_0003_campaign_contacts", '''
         CREATE TABLE IF NOT EXISTS campaign_contacts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             campaign_id INTEGER,
@@ -67,38 +187,73 @@ def init_users_table():
             letter_generated BOOLEAN DEFAULT FALSE,
             FOREIGN KEY (campaign_id) REFERENCES campaigns (id)
         )
-    ''')
-    conn.commit()
-    conn.close()
+    '''),
+    ("app_0004_campaign_contacts_by_parcel", normalize_campaign_contacts),
+    # Staged publishes on SQLite used to remove parcels without cascading to their contacts
+    ("app_0005_drop_orphaned_contacts", '''
+        DELETE FROM campaign_contacts WHERE parcel_rowid NOT IN (SELECT id FROM parcels);
+    '''),
+]
+
+# Contact rows as the views and the mail merge see them: membership state joined to the parcel
+CONTACT_SELECT = """
+    SELECT cc.campaign_id, cc.parcel_rowid, cc.email, cc.email_sent, cc.letter_generated, cc.offer,
+           p.parcel_id, p.owner_name, p.mailing_address1 AS mailing_address, p.mailing_city AS city,
+           p.mailing_state AS state, p.mailing_zip AS zip_code, p.situs_address AS property_address,
+           p.assessed_value
+    FROM campaign_contacts cc
+    JOIN parcels p ON p.id = cc.parcel_rowid
+"""
+
+def contact_dict(row):
+    contact = dict(row)
+    contact['first_name'], contact['last_name'] = parse_owner_name(contact['owner_name'])
+    return contact
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-def query_parcels(county, state, max_value=None, min_sqft=None, max_sqft=None, year_min=None):
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    query = "SELECT * FROM parcels WHERE county=? AND state=?"
-    params = [county, state]
-
+def query_parcels(county, state, max_value=None, min_sqft=None, max_sqft=None, year_min=None, area=None):
+    """Matching parcels as dicts; `area` is a geo.Radius/BBox/Polygon, pruned through the spatial index"""
+    conn = get_db()
+    backend = storage.get_backend(current_app.config['DATABASE'])
+
+    query = "SELECT parcels.* FROM parcels WHERE 1=1"
+    params = []
+
+    if area is not None:
+        source, condition, params = spatial_filter(backend, *area.bbox())
+        centroid_condition, centroid_params = area.where()
+        query = f"SELECT parcels.* FROM {source} WHERE {condition} AND {centroid_condition}"
+        params += centroid_params
+    if county:
+        query += " AND county=?"
+        params.append(county)
+    if state:
+        query += " AND state=?"
+        params.append(state)
     if max_value is not None:
         query += " AND (assessed_value <= ? OR taxable_value <= ?)"
         params.extend([max_value, max_value])
     if min_sqft is not None:
-        query += " AND IFNULL(building_sqft,0) >= ?"
+        query += " AND COALESCE(building_sqft,0) >= ?"
         params.append(min_sqft)
     if max_sqft is not None:
-        query += " AND IFNULL(building_sqft,0) <= ?"
+        query += " AND COALESCE(building_sqft,0) <= ?"
         params.append(max_sqft)
     if year_min is not None:
-        query += " AND IFNULL(year_built,0) >= ?"
+        query += " AND COALESCE(year_built,0) >= ?"
         params.append(year_min)
 
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    # Streamed in batches (a server-side cursor on PostgreSQL)
+    rows = (dict(r) for batch in backend.iter_batches(conn, query, params) for r in batch)
+    if area is not None:
+        return [r for r in rows if area.contains(r['centroid_lat'], r['centroid_lon'])]
+    return list(rows)
+
+def area_from(values):
+    """geo area from search form / campaign JSON fields; raises ValueError on malformed input"""
+    return geo.parse_area(values.get("center"), values.get("radius_miles"), values.get("bbox"), values.get("polygon"))
 
 def find_email_address(first_name, last_name, address, city, state, test_mode=False):
     """Attempt to find email address using various methods"""
@@ -134,14 +289,17 @@ def find_email_address(first_name, last_name, address, city, state, test_mode=Fa
 
     return None
 
+_OWNER_NOISE = re.compile(r'\b(LLC|INC|CORP|TRUST|ESTATE|ET AL|ETAL)\b')
+_CO_OWNERS = re.compile(r'[,&].*')
+
 def parse_owner_name(owner_name):
     """Extract first and last name from owner name"""
     if not owner_name:
         return None, None
 
     # Remove common suffixes and prefixes
-    cleaned = re.sub(r'\b(LLC|INC|CORP|TRUST|ESTATE|ET AL|ETAL)\b', '', owner_name.upper())
-    cleaned = re.sub(r'[,&].*', '', cleaned)  # Remove everything after comma or &
+    cleaned = _OWNER_NOISE.sub('', owner_name.upper())
+    cleaned = _CO_OWNERS.sub('', cleaned)  # Remove everything after comma or &
 
     parts = cleaned.strip().split()
     if len(parts) >= 2:
@@ -151,9 +309,12 @@ def parse_owner_name(owner_name):
 
     return None, None
 
-def generate_ai_letter(first_name, last_name, property_address, assessed_value, offer_percentage):
-    """Generate AI-powered letter content"""
-    offer_amount = int(assessed_value * (offer_percentage / 100)) if assessed_value else "competitive cash"
+def offer_phrase(offer):
+    """The campaign's offer as quoted in letters and emails; parcels without an assessed value get no figure"""
+    return f"${offer:,.0f} cash" if offer else "a competitive cash price"
+
+def generate_ai_letter(first_name, last_name, property_address, offer):
+    """Generate AI-powered letter content quoting the offer stored with the campaign"""
 
     letter_template = f"""
 {datetime.now().strftime('%B %d, %Y')}
@@ -172,7 +333,7 @@ Here's what I can offer:
 • Purchase the property in its current condition - no need for repairs or improvements
 • Flexible closing date to accommodate your timeline
 
-Based on my analysis of your property and current market conditions, I would like to offer ${offer_amount:,} for your home. This is a cash offer with no financing contingencies, meaning we can close quickly and with certainty.
+Based on my analysis of your property and current market conditions, I would like to offer {offer_phrase(offer)} for your home. This is a cash offer with no financing contingencies, meaning we can close quickly and with certainty.
 
 I understand this may be an unexpected offer, but I have found that many homeowners appreciate having this option available to them, especially when they need to sell quickly or want to avoid the traditional real estate process.
 
@@ -194,13 +355,110 @@ P.S. This is a no-obligation offer. I understand that selling your home is a big
 
     return letter_template.strip()
 
-@app.route("/", methods=["GET"])
+def open_smtp():
+    """Connect and authenticate to the SMTP server, recording connect latency"""
+    import smtplib
+    cfg = current_app.config
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        server = smtplib.SMTP(cfg['SMTP_SERVER'], cfg['SMTP_PORT'])
+        if cfg['SMTP_USE_TLS']:
+            server.starttls()
+        server.login(cfg['EMAIL_ADDRESS'], cfg['EMAIL_PASSWORD'])
+        outcome = "ok"
+        return server
+    finally:
+        metrics.SMTP_LATENCY.observe(time.perf_counter() - start, operation="connect", outcome=outcome)
+
+def send_message(server, msg):
+    """Send one message, recording SMTP latency by outcome"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        server.send_message(msg)
+        outcome = "ok"
+    finally:
+        metrics.SMTP_LATENCY.observe(time.perf_counter() - start, operation="send", outcome=outcome)
+
+def profile_job(label):
+    """Profile the wrapped view whenever PROFILE_DIR is configured"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            out_dir = current_app.config.get('PROFILE_DIR')
+            if not out_dir:
+                return view(*args, **kwargs)
+            import profiling
+            with profiling.profiled(label, out_dir, mode=current_app.config['PROFILE_MODE']) as result:
+                response = view(*args, **kwargs)
+            if result:
+                log_event("profile_written", job=label, summary=result.summary_path,
+                          wall_seconds=round(result.wall_seconds, 3), peak_bytes=result.peak_bytes)
+            return response
+        return wrapper
+    return decorator
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.before_app_request
+def start_request_profile():
+    cfg = current_app.config
+    if request.args.get('profile') != '1' or session.get('username') not in cfg['ADMIN_USERS']:
+        return
+    import profiling
+    mode = request.args.get('profile_mode', cfg['PROFILE_MODE'])
+    if mode not in profiling.MODES:
+        mode = 'cprofile'
+    label = f"request-{request.endpoint or 'unknown'}"
+    g.profile_cm = profiling.profiled(label, cfg['PROFILE_DIR'] or 'profiles', mode=mode)
+    g.profile_result = g.profile_cm.__enter__()
+
+@bp.after_app_request
+def finish_request_profile(response):
+    cm = g.pop('profile_cm', None)
+    if cm is not None:
+        cm.__exit__(None, None, None)
+        result = g.pop('profile_result', None)
+        if result:
+            response.headers['X-Profile-Summary'] = os.path.basename(result.summary_path)
+            log_event("profile_written", job=result.label, summary=result.summary_path,
+                      wall_seconds=round(result.wall_seconds, 3), peak_bytes=result.peak_bytes)
+    return response
+
+@bp.teardown_app_request
+def abort_request_profile(exc):
+    cm = g.pop('profile_cm', None)
+    if cm is not None:
+        cm.__exit__(None, None, None)
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_LATENCY.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        log_event("request", logging.DEBUG, method=request.method, route=route,
+                  status=response.status_code, duration_ms=round(elapsed * 1000, 1))
+    return response
+
+@bp.route("/metrics")
+def metrics_endpoint():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@bp.route("/", methods=["GET"])
 def index():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template("dashboard.html")
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "GET":
         return render_template("login.html")
@@ -212,32 +470,28 @@ def login():
         flash("Please enter both username and password")
         return render_template("login.html")
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     cur = conn.cursor()
     
     # Check if user exists
     cur.execute("SELECT id, password_hash FROM users WHERE username=?", (username,))
     user = cur.fetchone()
     
-    print(f"Debug: Looking for user '{username}'")
-    print(f"Debug: User found: {user is not None}")
-    
     if user:
         stored_hash = user[1]
         provided_hash = hash_password(password)
-        print(f"Debug: Password hashes match: {stored_hash == provided_hash}")
         
         if stored_hash == provided_hash:
             session['user_id'] = user[0]
             session['username'] = username
-            conn.close()
-            return redirect(url_for('index'))
+            log_event("login_succeeded", user_id=user[0])
+            return redirect(url_for('main.index'))
     
-    conn.close()
+    log_event("login_failed", reason="bad_password" if user else "unknown_user")
     flash("Invalid username or password")
     return render_template("login.html")
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "GET":
         return render_template("register.html")
@@ -254,39 +508,37 @@ def register():
         flash("Passwords do not match")
         return render_template("register.html")
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     cur = conn.cursor()
     try:
         password_hash = hash_password(password)
-        print(f"Debug: Registering user '{username}' with hash: {password_hash}")
         
-        cur.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", 
+        cur.execute("INSERT INTO users (username, password_hash) VALUES (?, ?) RETURNING id", 
                    (username, password_hash))
+        user_id = cur.fetchone()[0]
         conn.commit()
         
-        print(f"Debug: User '{username}' registered successfully")
+        log_event("user_registered", user_id=user_id)
         flash("Registration successful! Please log in.")
-        return redirect(url_for('login'))
-    except sqlite3.IntegrityError as e:
-        print(f"Debug: Registration failed for '{username}': {e}")
+        return redirect(url_for('main.login'))
+    except storage.IntegrityError:
+        log_event("registration_rejected", reason="duplicate_username")
         flash("Username already exists")
         return render_template("register.html")
-    except Exception as e:
-        print(f"Debug: Unexpected error during registration: {e}")
+    except Exception:
+        metrics.logger.exception("registration_error")
         flash("Registration failed. Please try again.")
         return render_template("register.html")
-    finally:
-        conn.close()
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     session.clear()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route("/search", methods=["GET", "POST"])
+@bp.route("/search", methods=["GET", "POST"])
 def search():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     if request.method == "GET":
         return render_template("search.html")
@@ -303,38 +555,56 @@ def search():
     max_sqft = float(max_sqft) if max_sqft else None
     year_min = int(year_min) if year_min else None
 
-    properties = query_parcels(county, state, max_value, min_sqft, max_sqft, year_min)
+    try:
+        area = area_from(request.form)
+    except ValueError as e:
+        flash(f"Invalid search area: {e}")
+        return render_template("search.html", form_data=request.form), 400
+    if not county and area is None:
+        flash("Enter a county or a search area")
+        return render_template("search.html", form_data=request.form), 400
+
+    properties = query_parcels(county, state, max_value, min_sqft, max_sqft, year_min, area=area)
     return render_template("results.html", properties=properties, form_data=request.form)
 
-@app.route("/create_campaign", methods=["POST"])
+@bp.route("/create_campaign", methods=["POST"])
+@profile_job("create_campaign")
 def create_campaign():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     data = request.get_json()
     county = data.get("county")
     state = data.get("state", "MI")
     max_value = data.get("max_value")
     offer_percentage = data.get("offer_percentage", 60)
-    campaign_name = data.get("campaign_name", f"{county} Campaign")
+    campaign_name = data.get("campaign_name", f"{county or 'Area'} Campaign")
     test_mode = data.get("test_mode", False)
     test_email = data.get("test_email", "")
+    try:
+        area = area_from(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid search area: {e}'}), 400
+    if not county and area is None:
+        # Without either, the parcel query has no filter at all and would take every county
+        return jsonify({'success': False, 'error': 'A county or a search area is required'}), 400
 
     # Create campaign
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("""
         INSERT INTO campaigns (user_id, name, county, state, max_value, offer_percentage, test_mode, test_email)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING id
     """, (session['user_id'], campaign_name, county, state, max_value, offer_percentage, test_mode, test_email))
 
-    campaign_id = cur.lastrowid
+    campaign_id = cur.fetchone()[0]
 
     # Get properties
-    properties = query_parcels(county, state, max_value)
+    properties = query_parcels(county, state, max_value, area=area)
 
     # Process each property
-    contacts_added = 0
+    members = []
     for prop in properties:
         if not prop.get('owner_name'):
             continue
@@ -352,64 +622,61 @@ def create_campaign():
             test_mode=test_mode
         )
 
-        # Add to campaign contacts
-        cur.execute("""
-            INSERT INTO campaign_contacts 
-            (campaign_id, parcel_id, owner_name, first_name, last_name, email, 
-             mailing_address, city, state, zip_code, property_address, assessed_value)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            campaign_id, prop.get('parcel_id'), prop.get('owner_name'),
-            first_name, last_name, email,
-            prop.get('mailing_address1', ''), prop.get('mailing_city', ''),
-            prop.get('mailing_state', ''), prop.get('mailing_zip', ''),
-            prop.get('situs_address', ''), prop.get('assessed_value')
-        ))
-        contacts_added += 1
+        value = prop.get('assessed_value')
+        offer = value * float(offer_percentage) / 100 if value else None
+        members.append((campaign_id, prop['id'], email, offer, email))
+
+    # Membership only: one narrow row per parcel, the rest is joined from parcels on read.
+    # Owners whose address bounced or opted out are left out entirely (no email, no letter),
+    # checked against the suppressions index inside the INSERT
+    cur.executemany("""
+        INSERT INTO campaign_contacts (campaign_id, parcel_rowid, email, offer)
+        SELECT ?, ?, CAST(? AS TEXT), CAST(? AS DOUBLE PRECISION)
+        WHERE """ + suppression.not_suppressed("?"), members)
+    contacts_added = cur.execute("SELECT COUNT(*) FROM campaign_contacts WHERE campaign_id = ?",
+                                 (campaign_id,)).fetchone()[0]
+    emails_suppressed = len(members) - contacts_added
 
     conn.commit()
-    conn.close()
 
     return jsonify({
         'success': True,
         'campaign_id': campaign_id,
         'contacts_added': contacts_added,
+        'emails_suppressed': emails_suppressed,
         'test_mode': test_mode
     })
 
-@app.route("/campaigns")
+@bp.route("/campaigns")
 def campaigns():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
     cur.execute("""
         SELECT c.*, 
-               COUNT(cc.id) as total_contacts,
+               COUNT(cc.parcel_rowid) as total_contacts,
                COUNT(CASE WHEN cc.email IS NOT NULL THEN 1 END) as with_email,
-               COUNT(CASE WHEN cc.email_sent = 1 THEN 1 END) as emails_sent
+               COUNT(CASE WHEN cc.email_sent THEN 1 END) as emails_sent
         FROM campaigns c
-        LEFT JOIN campaign_contacts cc ON c.id = cc.campaign_id
+        LEFT JOIN (campaign_contacts cc JOIN parcels p ON p.id = cc.parcel_rowid) ON c.id = cc.campaign_id
         WHERE c.user_id = ?
         GROUP BY c.id
         ORDER BY c.created_at DESC
     """, (session['user_id'],))
 
     campaigns_data = cur.fetchall()
-    conn.close()
 
     return render_template("campaigns.html", campaigns=campaigns_data)
 
-@app.route("/campaign/<int:campaign_id>")
+@bp.route("/campaign/<int:campaign_id>")
 def campaign_detail(campaign_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
     # Get campaign info
@@ -419,26 +686,28 @@ def campaign_detail(campaign_id):
 
     if not campaign:
         flash("Campaign not found")
-        return redirect(url_for('campaigns'))
+        return redirect(url_for('main.campaigns'))
 
     # Get contacts
-    cur.execute("""
-        SELECT * FROM campaign_contacts 
-        WHERE campaign_id = ? 
-        ORDER BY email IS NOT NULL DESC, last_name
-    """, (campaign_id,))
-    contacts = cur.fetchall()
+    cur.execute(CONTACT_SELECT + " WHERE cc.campaign_id = ?", (campaign_id,))
+    contacts = [contact_dict(row) for row in cur.fetchall()]
+    contacts.sort(key=lambda c: (c['email'] is None, c['last_name'] or ''))
 
-    conn.close()
 
     return render_template("campaign_detail.html", campaign=campaign, contacts=contacts)
 
-@app.route("/send_emails/<int:campaign_id>", methods=["POST"])
+@bp.route("/send_emails/<int:campaign_id>", methods=["POST"])
+@profile_job("send_emails")
 def send_emails(campaign_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
+
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    cfg = current_app.config
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     cur = conn.cursor()
 
     # Get campaign info
@@ -452,41 +721,35 @@ def send_emails(campaign_id):
             return jsonify({'success': False, 'error': 'Test email not provided'})
 
         # In test mode, send one sample email to the test address
-        cur.execute("""
-            SELECT cc.*, c.offer_percentage 
-            FROM campaign_contacts cc
-            JOIN campaigns c ON cc.campaign_id = c.id
-            WHERE cc.campaign_id = ? AND cc.email IS NOT NULL
-            LIMIT 1
-        """, (campaign_id,))
-        contact = cur.fetchone()
+        cur.execute(CONTACT_SELECT + " WHERE cc.campaign_id = ? AND cc.email IS NOT NULL AND "
+                    + suppression.not_suppressed("cc.email") + " LIMIT 1", (campaign_id,))
+        row = cur.fetchone()
+        contact = contact_dict(row) if row else None
 
         if not contact:
             return jsonify({'success': False, 'error': 'No contacts with emails found'})
 
         try:
-            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-            server.starttls()
-            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+            server = open_smtp()
 
             # Create test email
             msg = MIMEMultipart()
-            msg['From'] = EMAIL_ADDRESS
+            msg['From'] = cfg['EMAIL_ADDRESS']
             msg['To'] = test_email
-            msg['Subject'] = f"TEST EMAIL - Cash Offer for Property at {contact[10]}"
+            msg['Subject'] = f"TEST EMAIL - Cash Offer for Property at {contact['property_address']}"
 
             # Email body with test notice
             body = f"""
 *** THIS IS A TEST EMAIL - NOT SENT TO ACTUAL PROPERTY OWNER ***
 
-This is how your email would look when sent to: {contact[4]} {contact[5]}
-Original email would go to: {contact[6]}
+This is how your email would look when sent to: {contact['first_name']} {contact['last_name']}
+Original email would go to: {contact['email']}
 
 ---
 
-Dear {contact[4]} {contact[5]},
+Dear {contact['first_name']} {contact['last_name']},
 
-I hope this email finds you well. I am a local real estate investor, and I'm interested in purchasing your property at {contact[10]} for cash.
+I hope this email finds you well. I am a local real estate investor, and I'm interested in purchasing your property at {contact['property_address']} for cash.
 
 I can offer you a quick, hassle-free sale with:
 • Cash purchase - no financing contingencies
@@ -494,7 +757,7 @@ I can offer you a quick, hassle-free sale with:
 • No real estate agent fees
 • Buy as-is condition
 
-Based on current market conditions, I can offer ${contact[12] * (contact[13]/100):,.0f} cash for your property.
+Based on current market conditions, I can offer {offer_phrase(contact['offer'])} for your property.
 
 If you're interested in learning more, please reply to this email or call me.
 
@@ -507,50 +770,45 @@ Best regards,
             """.strip()
 
             msg.attach(MIMEText(body, 'plain'))
-            server.send_message(msg)
+            send_message(server, msg)
             server.quit()
 
             return jsonify({'success': True, 'emails_sent': 1, 'test_mode': True, 'message': f'Test email sent to {test_email}'})
 
         except Exception as e:
             return jsonify({'success': False, 'error': f'Failed to send test email: {str(e)}'})
-        finally:
-            conn.close()
 
     else:
         # Production mode - send actual emails
-        if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
+        if not cfg['EMAIL_ADDRESS'] or not cfg['EMAIL_PASSWORD']:
             return jsonify({'success': False, 'error': 'Email credentials not configured'})
 
         # Get campaign and contacts with emails
-        cur.execute("""
-            SELECT cc.*, c.offer_percentage 
-            FROM campaign_contacts cc
-            JOIN campaigns c ON cc.campaign_id = c.id
-            WHERE cc.campaign_id = ? AND cc.email IS NOT NULL AND cc.email_sent = 0
-        """, (campaign_id,))
+        # Suppressed addresses are filtered out here, before anything is loaded
+        cur.execute(CONTACT_SELECT + " WHERE cc.campaign_id = ? AND cc.email IS NOT NULL AND NOT cc.email_sent AND "
+                    + suppression.not_suppressed("cc.email"), (campaign_id,))
 
-        contacts = cur.fetchall()
+        contacts = [contact_dict(row) for row in cur.fetchall()]
 
         emails_sent = 0
         try:
-            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-            server.starttls()
-            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+            server = open_smtp()
 
             for contact in contacts:
                 try:
                     # Create email
                     msg = MIMEMultipart()
-                    msg['From'] = EMAIL_ADDRESS
-                    msg['To'] = contact[6]  # email
-                    msg['Subject'] = f"Cash Offer for Your Property at {contact[10]}"  # property_address
+                    msg['From'] = cfg['EMAIL_ADDRESS']
+                    msg['To'] = contact['email']
+                    msg['Subject'] = f"Cash Offer for Your Property at {contact['property_address']}"
+                    # Unsubscribe replies land in the inbox `suppression.py ingest` reads
+                    msg['List-Unsubscribe'] = f"<mailto:{cfg['EMAIL_ADDRESS']}?subject=unsubscribe>"
 
                     # Email body
                     body = f"""
-Dear {contact[4]} {contact[5]},
+Dear {contact['first_name']} {contact['last_name']},
 
-I hope this email finds you well. I am a local real estate investor, and I'm interested in purchasing your property at {contact[10]} for cash.
+I hope this email finds you well. I am a local real estate investor, and I'm interested in purchasing your property at {contact['property_address']} for cash.
 
 I can offer you a quick, hassle-free sale with:
 • Cash purchase - no financing contingencies
@@ -558,7 +816,7 @@ I can offer you a quick, hassle-free sale with:
 • No real estate agent fees
 • Buy as-is condition
 
-Based on current market conditions, I can offer ${contact[12] * (contact[13]/100):,.0f} cash for your property.
+Based on current market conditions, I can offer {offer_phrase(contact['offer'])} for your property.
 
 If you're interested in learning more, please reply to this email or call me.
 
@@ -569,45 +827,48 @@ Best regards,
 
                     msg.attach(MIMEText(body, 'plain'))
 
-                    server.send_message(msg)
+                    send_message(server, msg)
 
-                    # Mark as sent
-                    cur.execute("UPDATE campaign_contacts SET email_sent = 1 WHERE id = ?", (contact[0],))
+                    # Mark as sent, durably: a later failure must not roll this back and resend it
+                    cur.execute("UPDATE campaign_contacts SET email_sent = TRUE WHERE campaign_id = ? AND parcel_rowid = ?",
+                                (campaign_id, contact['parcel_rowid']))
+                    conn.commit()
                     emails_sent += 1
 
-                    time.sleep(1)  # Rate limiting
+                    time.sleep(cfg['SEND_DELAY_SECONDS'])  # Rate limiting
 
+                except smtplib.SMTPRecipientsRefused as e:
+                    # Rejected outright by the server: a hard bounce, never retry it
+                    refused = [(addr, "bounce", f"{code} {reply.decode(errors='replace')}")
+                               for addr, (code, reply) in e.recipients.items() if code >= 500]
+                    suppression.suppress(conn, refused, source="smtp")
+                    conn.commit()
+                    log_event("email_send_failed", logging.WARNING, campaign_id=campaign_id,
+                              parcel_rowid=contact['parcel_rowid'], error=str(e), suppressed=len(refused))
                 except Exception as e:
-                    print(f"Failed to send email to {contact[6]}: {e}")
+                    log_event("email_send_failed", logging.WARNING, campaign_id=campaign_id,
+                              parcel_rowid=contact['parcel_rowid'], error=str(e))
 
             server.quit()
             conn.commit()
 
         except Exception as e:
-            return jsonify({'success': False, 'error': str(e)})
-        finally:
-            conn.close()
+            return jsonify({'success': False, 'error': str(e), 'emails_sent': emails_sent})
 
         return jsonify({'success': True, 'emails_sent': emails_sent, 'test_mode': False})
 
-@app.route("/generate_letters/<int:campaign_id>")
+@bp.route("/generate_letters/<int:campaign_id>")
 def generate_letters(campaign_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
-    # Get campaign and contacts without emails
-    cur.execute("""
-        SELECT cc.*, c.offer_percentage 
-        FROM campaign_contacts cc
-        JOIN campaigns c ON cc.campaign_id = c.id
-        WHERE cc.campaign_id = ? AND (cc.email IS NULL OR cc.email = '')
-    """, (campaign_id,))
+    # Contacts without emails get a letter quoting the same offer their campaign would email
+    cur.execute(CONTACT_SELECT + " WHERE cc.campaign_id = ? AND (cc.email IS NULL OR cc.email = '')", (campaign_id,))
 
-    contacts = cur.fetchall()
+    contacts = [contact_dict(row) for row in cur.fetchall()]
 
     letters = []
     for contact in contacts:
@@ -615,40 +876,35 @@ def generate_letters(campaign_id):
             contact['first_name'],
             contact['last_name'],
             contact['property_address'],
-            contact['assessed_value'],
-            contact['offer_percentage']
+            contact['offer']
         )
 
         letters.append({
-            'contact': dict(contact),
+            'contact': contact,
             'letter': letter_content
         })
 
-        # Mark letter as generated
-        cur.execute("UPDATE campaign_contacts SET letter_generated = 1 WHERE id = ?", (contact['id'],))
+    # Mark letters as generated
+    cur.executemany("UPDATE campaign_contacts SET letter_generated = TRUE WHERE campaign_id = ? AND parcel_rowid = ?",
+                    [(campaign_id, c['parcel_rowid']) for c in contacts])
 
     conn.commit()
-    conn.close()
 
     return render_template("letters.html", letters=letters, campaign_id=campaign_id)
 
-@app.route("/export/<int:campaign_id>")
+@bp.route("/export/<int:campaign_id>")
 def export_campaign(campaign_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("""
-        SELECT first_name, last_name, email, mailing_address, city, state, zip_code,
-               property_address, assessed_value, email_sent, letter_generated
-        FROM campaign_contacts 
-        WHERE campaign_id = ?
-    """, (campaign_id,))
+    # Owners who opted out after the campaign was built are not exported for a mail merge either
+    cur.execute(CONTACT_SELECT + " WHERE cc.campaign_id = ? AND (cc.email IS NULL OR "
+                + suppression.not_suppressed("cc.email") + ")", (campaign_id,))
 
-    rows = cur.fetchall()
-    conn.close()
+    rows = (contact_dict(row) for row in cur.fetchall())
 
     buf = io.StringIO()
     writer = csv.writer(buf)
@@ -657,8 +913,10 @@ def export_campaign(campaign_id):
         "Property Address", "Assessed Value", "Email Sent", "Letter Generated"
     ])
 
-    for row in rows:
-        writer.writerow(row)
+    for c in rows:
+        writer.writerow([c['first_name'], c['last_name'], c['email'], c['mailing_address'], c['city'], c['state'],
+                         c['zip_code'], c['property_address'], c['assessed_value'], c['email_sent'],
+                         c['letter_generated']])
 
     csv_data = buf.getvalue()
     buf.close()
@@ -669,10 +927,35 @@ def export_campaign(campaign_id):
         headers={"Content-Disposition": f"attachment; filename=campaign_{campaign_id}_export.csv"}
     )
 
-def init_database():
-    """Initialize all database tables"""
-    init_users_table()
+def init_database(target=DB_FILE):
+    """Initialize all database tables; safe to call from many workers at once"""
+    from schema_parcels import MIGRATIONS as PARCEL_MIGRATIONS
+    from suppression import MIGRATIONS as SUPPRESSION_MIGRATIONS
+    backend = storage.get_backend(target)
+    conn = backend.connect()
+    try:
+        # Serialize DDL across worker processes; every migration runs exactly once
+        with backend.schema_lock(conn):
+            backend.prepare(conn)
+            # Parcels first: campaign contacts reference them
+            storage.apply_migrations(conn, PARCEL_MIGRATIONS + APP_MIGRATIONS + SUPPRESSION_MIGRATIONS)
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
-    init_database()
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    import argparse
+    import profiling
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--profile", metavar="DIR", help="profile campaign creation and email sends into DIR")
+    ap.add_argument("--profile_mode", choices=profiling.MODES, default=os.environ.get('PROFILE_MODE', 'cprofile'))
+    ap.add_argument("--host", default=os.environ.get('HOST', '127.0.0.1'))
+    ap.add_argument("--port", type=int, default=int(os.environ.get('PORT', 5000)))
+    # The Werkzeug debugger runs arbitrary code for whoever can reach it: local development only
+    ap.add_argument("--debug", action="store_true", default=os.environ.get('FLASK_DEBUG') == '1',
+                    help="enable the debugger and reloader (default $FLASK_DEBUG=1)")
+    cli = ap.parse_args()
+    overrides = {'PROFILE_DIR': cli.profile, 'PROFILE_MODE': cli.profile_mode} if cli.profile else None
+
+    # Development server only; serve production with: gunicorn -c gunicorn.conf.py wsgi:app
+    app = create_app(overrides)
+    app.run(host=cli.host, port=cli.port, debug=cli.debug)
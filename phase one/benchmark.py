@@ -0,0 +1,524 @@
+"""
+Reproducible benchmark suite for ingest, search, campaigns, sending and export.
+
+Generates synthetic parcel data in the `schema_parcels` shape, an Ottawa-style
+CSV, a stub Kent FeatureServer and a stub SMTP server, then times each stage
+end to end and writes JSON results that can be compared between commits:
+
+    python benchmark.py --sizes 10000,100000 --out bench_<commit>.json
+    python benchmark.py --compare bench_old.json bench_new.json
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import random
+import socketserver
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import geo
+
+DEFAULT_SIZES = "10000,100000,1000000"
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda",
+               "David", "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+              "Rodriguez", "Martinez", "Hernandez", "Lopez", "Vanderberg", "Dekker", "Visser", "Bos"]
+OWNER_SUFFIXES = ["", "", "", " & JANE", " TRUST", " LLC", " ET AL"]
+STREETS = ["Main St", "Oak Ave", "Lake Michigan Dr", "Fulton St", "Chicago Dr", "Butternut Dr",
+           "Baldwin St", "Port Sheldon St", "Riley St", "James St"]
+CITIES = [("Holland", "49423"), ("Grand Haven", "49417"), ("Zeeland", "49464"),
+          ("Hudsonville", "49426"), ("Allendale", "49401"), ("Jenison", "49428")]
+PROPERTY_CLASSES = ["401", "401", "401", "402", "201", "101"]
+
+OTTAWA_HEADERS = {
+    "parcel_id": "Parcel Number",
+    "situs_address": "Property Address",
+    "city": "City",
+    "state": "State",
+    "zip_code": "Zip",
+    "property_class": "Property Class",
+    "owner_name": "Owner Name",
+    "mailing_address1": "Mailing Address",
+    "mailing_city": "Mailing City",
+    "mailing_state": "Mailing State",
+    "mailing_zip": "Mailing Zip",
+    "assessed_value": "SEV",
+    "taxable_value": "Taxable Value",
+    "building_sqft": "Bldg SqFt",
+    "year_built": "Year Built",
+    "centroid_lat": "Latitude",
+    "centroid_lon": "Longitude",
+}
+
+# West Michigan-ish extent for synthetic parcel locations
+LAT_RANGE = (42.80, 43.20)
+LON_RANGE = (-86.20, -85.40)
+
+
+def synthetic_rows(n, county="Ottawa", state="MI", seed=0):
+    """Yield `n` deterministic parcel rows shaped like the `parcels` table."""
+    rng = random.Random(seed)
+    for i in range(n):
+        city, zip_code = rng.choice(CITIES)
+        address = f"{rng.randint(1, 19999)} {rng.choice(STREETS)}"
+        absentee = rng.random() < 0.2
+        assessed = round(rng.lognormvariate(12.0, 0.5), -2)
+        lat, lon = round(rng.uniform(*LAT_RANGE), 6), round(rng.uniform(*LON_RANGE), 6)
+        yield {
+            "county": county,
+            "state": state,
+            "parcel_id": f"70-{i // 10000:02d}-{i % 10000:05d}",
+            "situs_address": address,
+            "city": city,
+            "zip_code": zip_code,
+            "property_class": rng.choice(PROPERTY_CLASSES),
+            "owner_name": f"{rng.choice(LAST_NAMES).upper()} {rng.choice(FIRST_NAMES).upper()}"
+                          f"{rng.choice(OWNER_SUFFIXES)}",
+            "mailing_address1": f"{rng.randint(1, 19999)} {rng.choice(STREETS)}" if absentee else address,
+            "mailing_city": rng.choice(CITIES)[0] if absentee else city,
+            "mailing_state": state,
+            "mailing_zip": zip_code,
+            "land_sqft": float(rng.randint(3000, 40000)),
+            "building_sqft": float(rng.randint(600, 4500)),
+            "assessed_value": assessed,
+            "taxable_value": round(assessed * rng.uniform(0.6, 1.0), -2),
+            "year_built": rng.randint(1890, 2024),
+            "source": "benchmark",
+            "source_updated_at": None,
+            **geo.point_geometry(lat, lon),
+        }
+
+
+def write_ottawa_csv(path, n, seed=0):
+    """Write an Ottawa "Parcel Data Export" style CSV with `n` rows."""
+    with open(path, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(OTTAWA_HEADERS.values())
+        for r in synthetic_rows(n, seed=seed):
+            writer.writerow([r[k] for k in OTTAWA_HEADERS])
+    return path
+
+
+BOUNCE_DSN = """From: MAILER-DAEMON@mx.example.net
+To: offers@example.com
+Subject: Undelivered Mail Returned to Sender
+MIME-Version: 1.0
+Content-Type: multipart/report; report-type=delivery-status; boundary="{boundary}"
+
+--{boundary}
+Content-Type: text/plain
+
+This is the mail system at host mx.example.net.
+
+--{boundary}
+Content-Type: message/delivery-status
+
+Reporting-MTA: dns; mx.example.net
+
+Final-Recipient: rfc822; {address}
+Action: failed
+Status: 5.1.1
+Diagnostic-Code: smtp; 550 5.1.1 User unknown
+
+--{boundary}--
+"""
+
+
+def write_reply_maildir(path, bounced=(), unsubscribed=(), other=0):
+    """A Maildir of hard-bounce DSNs, unsubscribe replies and `other` ordinary replies."""
+    import mailbox
+    from email.message import EmailMessage
+    box = mailbox.Maildir(path, create=True)
+    for i, address in enumerate(bounced):
+        box.add(BOUNCE_DSN.format(address=address, boundary=f"dsn-{i}").encode())
+    for address in unsubscribed:
+        msg = EmailMessage()
+        msg["From"] = address
+        msg["Subject"] = "Re: Cash Offer for Your Property"
+        msg.set_content("Unsubscribe\n\n> Dear owner, ...")
+        box.add(msg.as_bytes())
+    for i in range(other):
+        msg = EmailMessage()
+        msg["From"] = f"interested{i}@example.org"
+        msg["Subject"] = "Re: Cash Offer for Your Property"
+        msg.set_content("Sounds interesting, please call me.")
+        box.add(msg.as_bytes())
+    box.close()
+    return path
+
+
+def kent_feature(i, rng, geometry=True):
+    city, zip_code = rng.choice(CITIES)
+    feature = {"attributes": {
+        "OBJECTID": i + 1,
+        "PNUM": f"41-{i // 10000:02d}-{i % 10000:05d}",
+        "PROPERTYADDRESS": f"{rng.randint(1, 19999)} {rng.choice(STREETS)}",
+        "PROPADDRESSCITY": city,
+        "PROPADDRESSSTATE_ZIPCODE": f"MI {zip_code}",
+        "PROPERTYCLASS": rng.choice(PROPERTY_CLASSES),
+    }}
+    if geometry:
+        # A ~30 m square lot, clockwise like ArcGIS outer rings
+        x, y, d = round(rng.uniform(*LON_RANGE), 6), round(rng.uniform(*LAT_RANGE), 6), 0.0003
+        feature["geometry"] = {"rings": [[[x, y], [x, y + d], [x + d, y + d], [x + d, y], [x, y]]]}
+    return feature
+
+
+class StubFeatureServer:
+    """Serves `n` synthetic Kent parcels with ArcGIS FeatureServer paging semantics."""
+
+    def __init__(self, n, seed=0):
+        self.n = n
+        self.seed = seed
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                qs = parse_qs(urlparse(self.path).query)
+                offset = int(qs.get("resultOffset", ["0"])[0])
+                count = int(qs.get("resultRecordCount", ["2000"])[0])
+                rng = random.Random(stub.seed * 1_000_003 + offset)
+                geometry = qs.get("returnGeometry", ["false"])[0] == "true"
+                feats = [kent_feature(i, rng, geometry) for i in range(offset, min(offset + count, stub.n))]
+                body = json.dumps({"features": feats}).encode()
+                stub.requests += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/query"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubSMTPServer:
+    """Minimal plaintext SMTP sink that accepts AUTH and counts delivered messages.
+
+    Recipients in `reject` get a permanent 550, like a mailbox that no longer exists.
+    """
+
+    def __init__(self, reject=()):
+        self.messages = 0
+        self.reject = {a.lower() for a in reject}
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                self.reply("220 benchmark ESMTP")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    verb = line.decode(errors="replace").strip().split(" ", 1)[0].upper()
+                    if verb == "EHLO":
+                        self.reply("250-benchmark")
+                        self.reply("250-AUTH PLAIN LOGIN")
+                        self.reply("250 8BITMIME")
+                    elif verb == "HELO":
+                        self.reply("250 benchmark")
+                    elif verb == "AUTH":
+                        self.reply("235 2.7.0 Authentication successful")
+                    elif verb == "RCPT" and line.decode(errors="replace").split(":", 1)[-1].strip(" <>\r\n").lower() in stub.reject:
+                        self.reply("550 5.1.1 User unknown")
+                    elif verb == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                            pass
+                        stub.messages += 1
+                        self.reply("250 2.0.0 Ok: queued")
+                    elif verb == "QUIT":
+                        self.reply("221 2.0.0 Bye")
+                        return
+                    else:
+                        self.reply("250 2.0.0 Ok")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@contextlib.contextmanager
+def stage(results, name, rows=None):
+    """Time a block and record seconds (and rows/sec when `rows` is known)."""
+    entry = {}
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        elapsed = time.perf_counter() - start
+        rows = entry.get("rows", rows)
+        entry["seconds"] = round(elapsed, 4)
+        if rows:
+            entry["rows"] = rows
+            entry["rows_per_sec"] = round(rows / elapsed, 1) if elapsed else None
+        results[name] = entry
+        print(f"   {name:<22} {elapsed:10.3f}s" + (f"  ({rows} rows)" if rows else ""))
+
+
+@contextlib.contextmanager
+def patched_argv(argv):
+    saved = sys.argv
+    sys.argv = argv
+    try:
+        yield
+    finally:
+        sys.argv = saved
+
+
+def run_size(n, workdir, args):
+    import app as web
+    import suppression
+    import etl_kent_mi
+    import etl_ottawa_mi_from_csv
+    from schema_parcels import ensure_db
+
+    results = {}
+    db = os.path.join(workdir, f"bench_{n}.db")
+    csv_path = os.path.join(workdir, f"ottawa_{n}.csv")
+    for path in (db, csv_path):
+        if os.path.exists(path):
+            os.remove(path)
+    random.seed(args.seed)
+    ensure_db(db)
+
+    with stage(results, "generate_csv", n):
+        write_ottawa_csv(csv_path, n, seed=args.seed)
+
+    upsert_n = min(n, args.upsert_cap) if args.upsert_cap else n
+    with StubFeatureServer(n, seed=args.seed) as fs, stage(results, "kent_fetch_normalize") as entry:
+        saved_url = etl_kent_mi.FEATURESERVER
+        etl_kent_mi.FEATURESERVER = fs.url
+        try:
+            kent_rows, fetched, offset = [], 0, 0
+            while True:
+                feats = etl_kent_mi.fetch_page(result_offset=offset, result_record_count=args.pagesize)[0]["features"]
+                if not feats:
+                    break
+                rows = [etl_kent_mi.normalize_feature(f) for f in feats]
+                fetched += len(rows)
+                kent_rows.extend(rows[:max(0, upsert_n - len(kent_rows))])
+                offset += args.pagesize
+        finally:
+            etl_kent_mi.FEATURESERVER = saved_url
+        entry["rows"] = fetched
+        entry["pages"] = fs.requests
+
+    with stage(results, "upsert_rows", upsert_n):
+        for i in range(0, upsert_n, args.pagesize):
+            etl_kent_mi.upsert_rows(db, kent_rows[i:min(i + args.pagesize, upsert_n)])
+    del kent_rows
+
+    kent_db = os.path.join(workdir, f"kent_{n}.db")
+    if os.path.exists(kent_db):
+        os.remove(kent_db)
+    ensure_db(kent_db)
+    with StubFeatureServer(n, seed=args.seed) as fs, stage(results, "kent_pipeline") as entry:
+        saved_url = etl_kent_mi.FEATURESERVER
+        etl_kent_mi.FEATURESERVER = fs.url
+        try:
+            pipeline = etl_kent_mi.KentPipeline(kent_db, pagesize=args.pagesize, max_pages=n // args.pagesize + 2,
+                                                fetchers=args.fetchers, delay=0)
+            entry["rows"] = pipeline.run()
+        finally:
+            etl_kent_mi.FEATURESERVER = saved_url
+        entry["utilization"] = {name: round(st.utilization(pipeline.wall), 3)
+                                for name, st in pipeline.stats.items()}
+    os.remove(kent_db)
+
+    with stage(results, "ottawa_import", n):
+        with patched_argv(["etl_ottawa_mi_from_csv.py", "--db", db, "--csv", csv_path]):
+            etl_ottawa_mi_from_csv.main()
+
+    app = web.create_app({
+        "DATABASE": db,
+        "SEND_DELAY_SECONDS": 0,
+        "SMTP_USE_TLS": False,
+        "EMAIL_ADDRESS": "bench@example.com",
+        "EMAIL_PASSWORD": "benchmark",
+    })
+    max_value = args.max_value
+
+    with app.app_context(), stage(results, "query_parcels") as entry:
+        entry["rows"] = len(web.query_parcels("Ottawa", "MI", max_value))
+
+    # A ~1 mile neighborhood, answered through the spatial index
+    center_lat, center_lon = sum(LAT_RANGE) / 2, sum(LON_RANGE) / 2
+    with app.app_context(), stage(results, "query_radius") as entry:
+        entry["rows"] = len(web.query_parcels(None, "MI", max_value, area=geo.Radius(center_lat, center_lon, 1.0)))
+    with app.app_context(), stage(results, "query_polygon") as entry:
+        triangle = geo.Polygon([(center_lat - 0.02, center_lon - 0.03), (center_lat + 0.02, center_lon),
+                                (center_lat - 0.02, center_lon + 0.03)])
+        entry["rows"] = len(web.query_parcels(None, "MI", max_value, area=triangle))
+
+    client = app.test_client()
+    conn = sqlite3.connect(db)
+    conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)",
+                 ("benchmark", web.hash_password("benchmark")))
+    user_id = conn.execute("SELECT id FROM users WHERE username='benchmark'").fetchone()[0]
+    conn.commit()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+        sess["username"] = "benchmark"
+
+    with stage(results, "create_campaign") as entry:
+        resp = client.post("/create_campaign", json={
+            "county": "Ottawa", "state": "MI", "max_value": max_value,
+            "campaign_name": f"Benchmark {n}", "test_mode": False,
+        })
+        payload = resp.get_json()
+        entry["rows"] = payload["contacts_added"]
+    campaign_id = payload["campaign_id"]
+
+    # Only the first `send_count` contacts stay pending so the send stage is bounded.
+    pending = [r[0] for r in conn.execute(
+        "SELECT parcel_rowid FROM campaign_contacts WHERE campaign_id=? AND email IS NOT NULL "
+        "ORDER BY parcel_rowid LIMIT ?",
+        (campaign_id, args.send_count))]
+    conn.execute("UPDATE campaign_contacts SET email_sent=1 WHERE campaign_id=? AND email IS NOT NULL",
+                 (campaign_id,))
+    conn.executemany("UPDATE campaign_contacts SET email_sent=0 WHERE campaign_id=? AND parcel_rowid=?",
+                     [(campaign_id, i) for i in pending])
+    conn.commit()
+
+    # A quarter of the pending addresses bounced and a quarter unsubscribed; another eighth
+    # will be refused by the SMTP server during the send
+    pending_emails = [r[0] for r in conn.execute(
+        "SELECT email FROM campaign_contacts WHERE campaign_id=? AND NOT email_sent AND email IS NOT NULL",
+        (campaign_id,))]
+    maildir = write_reply_maildir(os.path.join(workdir, f"replies_{n}"), bounced=pending_emails[0::4],
+                                  unsubscribed=pending_emails[1::4], other=len(pending_emails) // 4)
+    with stage(results, "ingest_suppressions") as entry:
+        inbox = suppression.MaildirInbox(maildir)
+        entry["rows"] = suppression.ingest(conn, inbox)["added"]
+        inbox.close()
+    conn.close()
+
+    with StubSMTPServer(reject=pending_emails[2::8]) as smtp:
+        app.config.update(SMTP_SERVER=smtp.host, SMTP_PORT=smtp.port)
+        with stage(results, "send_emails") as entry:
+            payload = client.post(f"/send_emails/{campaign_id}").get_json()
+            entry["rows"] = payload.get("emails_sent", 0)
+            entry["delivered"] = smtp.messages
+            entry["refused"] = len(smtp.reject)
+
+    with stage(results, "export_campaign") as entry:
+        resp = client.get(f"/export/{campaign_id}")
+        entry["rows"] = resp.get_data().count(b"\n") - 1
+        entry["bytes"] = len(resp.get_data())
+
+    results["db_bytes"] = os.path.getsize(db)
+    if not args.keep:
+        for path in (db, db + "-wal", db + "-shm", db + ".init.lock", csv_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(base_path, new_path):
+    with open(base_path) as fh:
+        base = json.load(fh)
+    with open(new_path) as fh:
+        new = json.load(fh)
+    print(f"{'size':>9} {'stage':<22} {'base s':>10} {'new s':>10} {'speedup':>8}")
+    for size, stages in new["results"].items():
+        for name, entry in stages.items():
+            old = base["results"].get(size, {}).get(name)
+            if not isinstance(entry, dict) or not isinstance(old, dict):
+                continue
+            ratio = old["seconds"] / entry["seconds"] if entry["seconds"] else float("inf")
+            print(f"{size:>9} {name:<22} {old['seconds']:>10.3f} {entry['seconds']:>10.3f} {ratio:>7.2f}x")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated row counts")
+    ap.add_argument("--out", help="JSON results file (default bench_<commit>.json)")
+    ap.add_argument("--workdir", help="where to build databases (default: a temp dir)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--pagesize", type=int, default=2000)
+    ap.add_argument("--max_value", type=float, default=250000)
+    ap.add_argument("--upsert_cap", type=int, default=20000,
+                    help="max rows pushed through upsert_rows per size (0 = all)")
+    ap.add_argument("--fetchers", type=int, default=4, help="concurrent fetchers for the Kent pipeline stage")
+    ap.add_argument("--send_count", type=int, default=500, help="contacts left pending for send_emails")
+    ap.add_argument("--keep", action="store_true", help="keep generated databases and CSVs")
+    ap.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files")
+    args = ap.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "pagesize": args.pagesize,
+            "upsert_cap": args.upsert_cap,
+            "fetchers": args.fetchers,
+            "send_count": args.send_count,
+        },
+        "results": {},
+    }
+    workdir = args.workdir or tempfile.mkdtemp(prefix="parcel-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    for n in sizes:
+        print(f"\n📊 Benchmarking {n:,} parcels in {workdir}")
+        report["results"][str(n)] = run_size(n, workdir, args)
+
+    out = args.out or f"bench_{commit or 'local'}.json"
+    with open(out, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\n✅ Wrote benchmark results to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,27 +2,82 @@
 ETL for Kent County, MI parcels (public open data)
 """
 import argparse
+import json
+import os
+import queue
 import requests
-import sqlite3
+import threading
 import time
-from schema_parcels import ensure_db
+import logging
+from metrics import configure_logging, etl_stage, log_event
+from profiling import add_profile_args, profile_from_args
+from source_cache import CacheMiss, add_cache_args, cache_from_args
+import storage
+from staging import StagedLoad, ValidationError, add_staging_args
+from geo import GEOMETRY_COLUMNS, feature_geometry
+from schema_parcels import PARCEL_COLUMNS, ensure_db, parcel_tuple
 
-FEATURESERVER = "https://gis.kentcountymi.gov/agisprod/rest/services/Open_Data_Kent_Co_Parcels/FeatureServer/1/query"
+# KENT_FEATURESERVER points the ETL at a mirror or a local stub instead
+FEATURESERVER = (os.environ.get("KENT_FEATURESERVER")
+                 or "https://gis.kentcountymi.gov/agisprod/rest/services/Open_Data_Kent_Co_Parcels/FeatureServer/1/query")
 FIELDS = ["PNUM","PROPERTYADDRESS","PROPADDRESSCITY","PROPADDRESSSTATE_ZIPCODE","PROPERTYCLASS","OBJECTID"]
 
-def fetch_page(result_offset=0, result_record_count=2000):
-    params = {
+def page_params(result_offset=0, result_record_count=2000):
+    return {
         "where": "1=1",
         "outFields": ",".join(FIELDS),
         "f": "json",
-        "returnGeometry": "false",
+        "returnGeometry": "true",
+        "outSR": 4326,  # lon/lat degrees
+        "geometryPrecision": 6,  # ~10 cm; keeps polygon payloads small
         "resultOffset": result_offset,
         "resultRecordCount": result_record_count,
         "orderByFields": "OBJECTID ASC"
     }
+
+def download_page(params):
     resp = requests.get(FEATURESERVER, params=params, timeout=60)
     resp.raise_for_status()
-    return resp.json()
+    return resp.content
+
+class RequestBudget:
+    """Token bucket shared by the fetchers: at most `per_minute` requests to the county server per minute"""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1.0, min(per_minute / 60.0, 10.0))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def fetch_page(result_offset=0, result_record_count=2000, cache=None, replay=False, budget=None):
+    """One page of features as parsed JSON, plus whether it came from `cache` (a SourceCache).
+
+    `budget` (a RequestBudget) is spent only on real downloads, never on cache hits.
+    """
+    params = page_params(result_offset, result_record_count)
+
+    def download():
+        if budget is not None:
+            budget.acquire()
+        return download_page(params)
+
+    if cache is None:
+        return json.loads(download()), False
+    body, hit = cache.fetch("kent", FEATURESERVER, params, download, offline=replay)
+    return json.loads(body), hit
 
 def normalize_feature(f):
     attrs = f.get("attributes", {})
@@ -50,58 +105,262 @@ def normalize_feature(f):
         "taxable_value": None,
         "year_built": None,
         "source": "Kent FeatureServer 1",
-        "source_updated_at": None
+        "source_updated_at": None,
+        **feature_geometry(f.get("geometry")),
     }
 
+UPDATE_COLUMNS = ["situs_address", "city", "zip_code", "property_class", "source", "source_updated_at"] + GEOMETRY_COLUMNS
+
 def upsert_rows(db, rows):
-    conn = sqlite3.connect(db)
-    cur = conn.cursor()
-    for r in rows:
-        cur.execute("""
-            SELECT id FROM parcels WHERE county=? AND state=? AND parcel_id=?
-        """, (r["county"], r["state"], r["parcel_id"]))
-        if cur.fetchone():
-            cur.execute("""
-                UPDATE parcels
-                SET situs_address=?, city=?, zip_code=?, property_class=?, source=?, source_updated_at=?
-                WHERE county=? AND state=? AND parcel_id=?
-            """, (r["situs_address"], r["city"], r["zip_code"], r["property_class"], r["source"], r["source_updated_at"],
-                  r["county"], r["state"], r["parcel_id"]))
-        else:
-            cur.execute("""
-                INSERT INTO parcels (county,state,parcel_id,situs_address,city,zip_code,property_class,owner_name,
-                    mailing_address1,mailing_city,mailing_state,mailing_zip,land_sqft,building_sqft,assessed_value,
-                    taxable_value,year_built,source,source_updated_at)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """, (r["county"], r["state"], r["parcel_id"], r["situs_address"], r["city"], r["zip_code"], r["property_class"],
-                  r["owner_name"], r["mailing_address1"], r["mailing_city"], r["mailing_state"], r["mailing_zip"],
-                  r["land_sqft"], r["building_sqft"], r["assessed_value"], r["taxable_value"], r["year_built"],
-                  r["source"], r["source_updated_at"]))
+    """Upsert rows into `parcels`; `db` is a storage target or an open connection (left open, committed)"""
+    owns_conn = isinstance(db, str)
+    conn = storage.get_backend(db).connect() if owns_conn else db
+    storage.backend_for(conn).upsert(conn, "parcels", ("county", "state", "parcel_id"), PARCEL_COLUMNS,
+                                     UPDATE_COLUMNS, [parcel_tuple(r) for r in rows])
     conn.commit()
-    conn.close()
+    if owns_conn:
+        conn.close()
+
+_DONE = object()
+
+class StageStats:
+    """Busy vs. waiting time for one pipeline stage, summed over its worker threads"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy=0.0, wait_in=0.0, wait_out=0.0, items=0):
+        with self._lock:
+            self.busy += busy
+            self.wait_in += wait_in
+            self.wait_out += wait_out
+            self.items += items
+
+    def utilization(self, wall):
+        return self.busy / (wall * self.workers) if wall else 0.0
+
+def _put(q, item, stats, abort):
+    """Blocking put that gives up if the pipeline aborts; time blocked here is backpressure"""
+    start = time.perf_counter()
+    try:
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if abort.is_set():
+                    return False
+    finally:
+        stats.add(wait_out=time.perf_counter() - start)
+
+def _get(q, stats, abort):
+    """Blocking get that returns _DONE if the pipeline aborts; time blocked here is starvation"""
+    start = time.perf_counter()
+    try:
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if abort.is_set():
+                    return _DONE
+    finally:
+        stats.add(wait_in=time.perf_counter() - start)
+
+class KentPipeline:
+    """Concurrent fetchers -> normalizer -> single long-lived writer, joined by bounded queues"""
+
+    def __init__(self, db, pagesize=2000, max_pages=999, fetchers=4, queue_size=8, delay=0.5, staging=None,
+                 cache=None, replay=False, budget=None):
+        self.db = db
+        self.staging = staging  # a begun StagedLoad: append there instead of upserting into the live table
+        self.cache = cache      # a SourceCache for raw pages; with replay, the only source
+        self.replay = replay
+        self.budget = budget    # a RequestBudget capping requests per minute across all fetchers
+        self.pagesize = pagesize
+        self.max_pages = max_pages
+        self.fetchers = fetchers
+        self.delay = delay
+        self.pages = queue.Queue(maxsize=queue_size)
+        self.rows = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()    # no more pages to claim
+        self.abort = threading.Event()   # a stage failed; unwind everything
+        self.errors = []
+        self.end_pages = []      # pages that came back empty
+        self.missing_pages = []  # replay: pages not in the cache
+        self.total_rows = 0
+        self._next_page = 0
+        self._page_lock = threading.Lock()
+        self.stats = {
+            "fetch": StageStats("fetch", fetchers),
+            "normalize": StageStats("normalize", 1),
+            "write": StageStats("write", 1),
+        }
+
+    def _claim_page(self):
+        with self._page_lock:
+            if self.stop.is_set() or self._next_page >= self.max_pages:
+                return None
+            page = self._next_page
+            self._next_page += 1
+            return page
+
+    def _fail(self, exc):
+        self.errors.append(exc)
+        self.abort.set()
+        self.stop.set()
+
+    def fetch_worker(self):
+        stats = self.stats["fetch"]
+        try:
+            while (page := self._claim_page()) is not None:
+                start = time.perf_counter()
+                try:
+                    with etl_stage("kent", "fetch"):
+                        data, cached = fetch_page(result_offset=page * self.pagesize,
+                                                  result_record_count=self.pagesize,
+                                                  cache=self.cache, replay=self.replay, budget=self.budget)
+                        feats = data.get("features", [])
+                except CacheMiss:
+                    # Fine if the crawl already ended before this page; run() checks
+                    self.missing_pages.append(page)
+                    self.stop.set()
+                    return
+                stats.add(busy=time.perf_counter() - start, items=1)
+                if not feats:
+                    self.end_pages.append(page)
+                    self.stop.set()
+                    return
+                if not _put(self.pages, (page, feats), stats, self.abort):
+                    return
+                if not cached:
+                    time.sleep(self.delay)  # politeness toward the county server only
+        except Exception as exc:
+            self._fail(exc)
+
+    def normalize_worker(self):
+        stats = self.stats["normalize"]
+        try:
+            while (item := _get(self.pages, stats, self.abort)) is not _DONE:
+                page, feats = item
+                start = time.perf_counter()
+                with etl_stage("kent", "normalize", len(feats)):
+                    rows = [normalize_feature(f) for f in feats]
+                stats.add(busy=time.perf_counter() - start, items=len(rows))
+                if not _put(self.rows, (page, rows), stats, self.abort):
+                    return
+        except Exception as exc:
+            self._fail(exc)
+        finally:
+            _put(self.rows, _DONE, stats, self.abort)
+
+    def write_worker(self):
+        stats = self.stats["write"]
+        conn = self.staging.connect() if self.staging else storage.get_backend(self.db).connect()
+        try:
+            while (item := _get(self.rows, stats, self.abort)) is not _DONE:
+                page, rows = item
+                start = time.perf_counter()
+                with etl_stage("kent", "write", len(rows)):
+                    if self.staging:
+                        self.staging.insert(conn, rows)
+                        conn.commit()
+                    else:
+                        upsert_rows(conn, rows)
+                elapsed = time.perf_counter() - start
+                stats.add(busy=elapsed, items=len(rows))
+                self.total_rows += len(rows)
+                log_event("etl_page", logging.DEBUG, source="kent", page=page, rows=len(rows),
+                          write_ms=round(elapsed * 1000, 1))
+        except Exception as exc:
+            self._fail(exc)
+        finally:
+            conn.close()
+
+    def run(self):
+        started = time.perf_counter()
+        fetchers = [threading.Thread(target=self.fetch_worker, name=f"kent-fetch-{i}", daemon=True)
+                    for i in range(self.fetchers)]
+        normalizer = threading.Thread(target=self.normalize_worker, name="kent-normalize", daemon=True)
+        writer = threading.Thread(target=self.write_worker, name="kent-write", daemon=True)
+        for t in fetchers + [normalizer, writer]:
+            t.start()
+        for t in fetchers:
+            t.join()
+        _put(self.pages, _DONE, self.stats["fetch"], self.abort)
+        normalizer.join()
+        writer.join()
+        self.wall = time.perf_counter() - started
+        if self.errors:
+            raise self.errors[0]
+        if self.missing_pages and not (self.end_pages and min(self.missing_pages) > min(self.end_pages)):
+            raise CacheMiss(f"Kent page {min(self.missing_pages)} is not in the cache; "
+                            "run once without --replay to fill it")
+        return self.total_rows
+
+    def report(self):
+        lines = [f"{'stage':<10} {'workers':>7} {'items':>8} {'busy s':>8} {'wait in':>8} {'wait out':>8} {'util':>6}"]
+        for st in self.stats.values():
+            lines.append(f"{st.name:<10} {st.workers:>7} {st.items:>8} {st.busy:>8.2f} {st.wait_in:>8.2f} "
+                         f"{st.wait_out:>8.2f} {st.utilization(self.wall):>6.0%}")
+        return "\n".join(lines)
+
+def run(args):
+    ensure_db(args.db)
+
+    load = None
+    if args.staging:
+        load = StagedLoad(args.db, "Kent", "MI", min_rows=args.min_rows, max_drop=args.max_drop)
+        load.begin()
+    cache = cache_from_args(args)
+    pipeline = KentPipeline(args.db, pagesize=args.pagesize, max_pages=args.max_pages,
+                            fetchers=args.fetchers, queue_size=args.queue_size, delay=args.delay, staging=load,
+                            cache=cache, replay=args.replay,
+                            budget=RequestBudget(args.max_rpm) if args.max_rpm else None)
+    try:
+        total_inserted = pipeline.run()
+    except CacheMiss as e:
+        raise SystemExit(f"❌ {e}")
+    if cache and not args.replay:
+        cache.evict()
+    log_event("etl_complete", source="kent", rows=total_inserted, wall_seconds=round(pipeline.wall, 3),
+              staged=args.staging, **{f"{name}_utilization": round(st.utilization(pipeline.wall), 3)
+                                      for name, st in pipeline.stats.items()})
+    print(pipeline.report())
+    if not load:
+        print(f"✅ Kent ETL complete. Upserted {total_inserted} records.")
+        return
+    try:
+        with etl_stage("kent", "publish"):
+            report = load.publish()
+    except ValidationError as e:
+        log_event("etl_rejected", logging.ERROR, source="kent", **e.report)
+        raise SystemExit(f"❌ {e}")
+    print(f"✅ Kent ETL published. {report['published']} records live: {report['inserted']} new, "
+          f"{report['updated']} changed, {report['deleted']} removed, {report['duplicates']} duplicates dropped.")
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--db", default="contacts.db")
+    ap.add_argument("--db", default="contacts.db", help="SQLite path or postgresql:// URL")
     ap.add_argument("--pagesize", type=int, default=2000)
     ap.add_argument("--max_pages", type=int, default=999)
+    ap.add_argument("--fetchers", type=int, default=4, help="concurrent page fetchers")
+    ap.add_argument("--queue_size", type=int, default=8, help="pages buffered between stages")
+    add_staging_args(ap)
+    add_cache_args(ap)
+    ap.add_argument("--delay", type=float, default=0.5, help="pause after each request, per fetcher")
+    ap.add_argument("--max_rpm", type=float, help="request budget: at most this many requests per minute, all fetchers")
+    add_profile_args(ap)
     args = ap.parse_args()
 
-    ensure_db(args.db)
-
-    result_offset = 0
-    total_inserted = 0
-    for _ in range(args.max_pages):
-        data = fetch_page(result_offset=result_offset, result_record_count=args.pagesize)
-        feats = data.get("features", [])
-        if not feats:
-            break
-        rows = [normalize_feature(f) for f in feats]
-        upsert_rows(args.db, rows)
-        total_inserted += len(rows)
-        result_offset += args.pagesize
-        time.sleep(0.5)
-    print(f"✅ Kent ETL complete. Upserted {total_inserted} records.")
+    configure_logging()
+    with profile_from_args(args, "etl_kent"):
+        run(args)
 
 if __name__ == "__main__":
     main()
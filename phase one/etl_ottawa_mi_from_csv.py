@@ -2,9 +2,17 @@
 ETL for Ottawa County, MI from their Parcel Data Export CSV
 """
 import argparse
-import sqlite3
+import io
+import logging
+import os
 import pandas as pd
-from schema_parcels import ensure_db
+from metrics import ETL_STAGE, configure_logging, etl_stage, log_event
+from profiling import add_profile_args, profile_from_args
+from source_cache import CacheMiss, add_cache_args, cache_from_args
+import storage
+from staging import StagedLoad, ValidationError, add_staging_args
+from geo import point_geometry
+from schema_parcels import PARCEL_COLUMNS, ensure_db, parcel_tuple
 
 COLMAP = {
     "parcel_id": ["parcel", "parcel number", "pnnum", "pnum", "apn", "parcelid", "parcel_id", "pid"],
@@ -22,6 +30,8 @@ COLMAP = {
     "building_sqft": ["building sqft", "improvement sqft", "bldg sqft", "bldgsqft", "impr sq ft"],
     "year_built": ["year built", "yr built", "yearbuilt"],
     "property_class": ["property class", "class", "prop class"],
+    "latitude": ["latitude", "lat", "centroid lat", "y"],
+    "longitude": ["longitude", "lon", "long", "centroid lon", "x"],
 }
 
 def pick(colnames, candidates):
@@ -31,14 +41,7 @@ def pick(colnames, candidates):
             return s[cand.lower()]
     return None
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--db", default="contacts.db")
-    ap.add_argument("--csv", required=True)
-    args = ap.parse_args()
-
-    ensure_db(args.db)
-    df = pd.read_csv(args.csv)
+def normalize_rows(df):
     cols = list(df.columns)
     mapping = {key: pick(cols, vals) for key, vals in COLMAP.items()}
 
@@ -47,6 +50,13 @@ def main():
         def v(k):
             col = mapping.get(k)
             return str(row[col]).strip() if col and pd.notna(row[col]) else None
+        def num(k, cast=float):
+            # Typed values, so PostgreSQL's REAL/INTEGER columns accept them as SQLite's affinity did
+            text = v(k)
+            try:
+                return cast(float(text.replace(",", ""))) if text else None
+            except ValueError:
+                return None
         rows.append({
             "county": "Ottawa",
             "state": "MI",
@@ -61,26 +71,100 @@ def main():
             "mailing_state": v("mailing_state"),
             "mailing_zip": v("mailing_zip"),
             "land_sqft": None,
-            "building_sqft": v("building_sqft"),
-            "assessed_value": v("assessed_value"),
-            "taxable_value": v("taxable_value"),
-            "year_built": v("year_built"),
+            "building_sqft": num("building_sqft"),
+            "assessed_value": num("assessed_value"),
+            "taxable_value": num("taxable_value"),
+            "year_built": num("year_built", int),
             "source": "Ottawa Parcel Data Export",
-            "source_updated_at": None
+            "source_updated_at": None,
+            **point_geometry(num("latitude"), num("longitude")),
         })
+    return rows
 
-    conn = sqlite3.connect(args.db)
-    cur = conn.cursor()
-    for r in rows:
-        cur.execute("""
-            INSERT INTO parcels (county,state,parcel_id,situs_address,city,zip_code,property_class,owner_name,
-                mailing_address1,mailing_city,mailing_state,mailing_zip,land_sqft,building_sqft,assessed_value,
-                taxable_value,year_built,source,source_updated_at)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """, tuple(r.values()))
+def insert_rows(db, rows):
+    backend = storage.get_backend(db)
+    conn = backend.connect()
+    backend.bulk_insert(conn, "parcels", PARCEL_COLUMNS, [parcel_tuple(r) for r in rows])
     conn.commit()
     conn.close()
-    print(f"✅ Ottawa import complete. Inserted {len(rows)} rows.")
+
+def read_export(args, cache):
+    """The export as a DataFrame; with a cache it is stored (or, with --replay, read back) by file name"""
+    if cache is None:
+        return pd.read_csv(args.csv)
+    params = {"file": os.path.basename(args.csv)} if args.csv else None
+    if not args.replay:
+        with open(args.csv, "rb") as fh:
+            body = fh.read()
+        cache.put("ottawa", "csv", params, body)
+    elif params:
+        body = cache.get("ottawa", "csv", params, allow_stale=True)
+        if body is None:
+            raise CacheMiss(f"ottawa: {params['file']} is not cached")
+    else:
+        latest = cache.latest("ottawa")
+        if latest is None:
+            raise CacheMiss("ottawa: no export is cached")
+        params, body = latest
+        print(f"♻️  Replaying cached export {params['file']}")
+    return pd.read_csv(io.BytesIO(body))
+
+def run(args):
+    if not args.csv and not args.replay:
+        raise SystemExit("❌ --csv is required (unless replaying from --cache)")
+    ensure_db(args.db)
+    cache = cache_from_args(args)
+    with etl_stage("ottawa", "read"):
+        try:
+            df = read_export(args, cache)
+        except CacheMiss as e:
+            raise SystemExit(f"❌ {e}")
+    if cache and not args.replay:
+        cache.evict()
+    with etl_stage("ottawa", "normalize", len(df)):
+        rows = normalize_rows(df)
+    if args.staging:
+        publish_staged(args, rows)
+    else:
+        with etl_stage("ottawa", "write", len(rows)):
+            insert_rows(args.db, rows)
+    log_event("etl_complete", source="ottawa", rows=len(rows), staged=args.staging,
+              **{f"{st}_seconds": round(ETL_STAGE.snapshot(source="ottawa", stage=st)[1], 3)
+                 for st in ("read", "normalize", "write", "publish")})
+    if not args.staging:
+        print(f"✅ Ottawa import complete. Inserted {len(rows)} rows.")
+
+def publish_staged(args, rows):
+    load = StagedLoad(args.db, "Ottawa", "MI", min_rows=args.min_rows, max_drop=args.max_drop)
+    load.begin()
+    with etl_stage("ottawa", "write", len(rows)):
+        conn = load.connect()
+        try:
+            load.insert(conn, rows)
+            conn.commit()
+        finally:
+            conn.close()
+    try:
+        with etl_stage("ottawa", "publish"):
+            report = load.publish()
+    except ValidationError as e:
+        log_event("etl_rejected", logging.ERROR, source="ottawa", **e.report)
+        raise SystemExit(f"❌ {e}")
+    print(f"✅ Ottawa import published. {report['published']} rows live: {report['inserted']} new, "
+          f"{report['updated']} changed, {report['deleted']} removed, {report['duplicates']} duplicates dropped.")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default="contacts.db", help="SQLite path or postgresql:// URL")
+    ap.add_argument("--csv", help="Parcel Data Export CSV (optional with --replay: the latest cached one)")
+    add_staging_args(ap)
+    add_cache_args(ap)
+    add_profile_args(ap)
+    args = ap.parse_args()
+
+    configure_logging()
+    with profile_from_args(args, "etl_ottawa"):
+        run(args)
 
 if __name__ == "__main__":
     main()
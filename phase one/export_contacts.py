@@ -2,27 +2,29 @@
 Filter parcels by criteria and export for mail-merge
 """
 import argparse
-import sqlite3
 import pandas as pd
+from profiling import add_profile_args, profile_from_args
+import storage
+from schema_parcels import PARCEL_COLUMNS
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--db", default="contacts.db")
-    ap.add_argument("--county", required=True)
-    ap.add_argument("--state", default="MI")
-    ap.add_argument("--max_value", type=float)
-    ap.add_argument("--min_sqft", type=float)
-    ap.add_argument("--max_sqft", type=float)
-    ap.add_argument("--year_min", type=int)
-    ap.add_argument("--out", required=True)
-    args = ap.parse_args()
+def run(args):
+    if args.snapshot:
+        # Parquet snapshot: filters are pushed down to partitions and row groups
+        from snapshot_parcels import read_snapshot
+        df = read_snapshot(args.snapshot, args.county, args.state, args.max_value,
+                           args.min_sqft, args.max_sqft, args.year_min)
+        df.to_csv(args.out, index=False)
+        print(f"✅ Wrote {len(df)} rows to {args.out} (from snapshot {args.snapshot})")
+        return
 
-    conn = sqlite3.connect(args.db)
-    df = pd.read_sql_query(
-        "SELECT * FROM parcels WHERE county=? AND state=?",
-        conn, params=[args.county, args.state]
-    )
+    backend = storage.get_backend(args.db)
+    conn = backend.connect()
+    columns = ["id"] + PARCEL_COLUMNS
+    rows = [tuple(r) for batch in backend.iter_batches(
+        conn, f"SELECT {','.join(columns)} FROM parcels WHERE county=? AND state=?", (args.county, args.state)
+    ) for r in batch]
     conn.close()
+    df = pd.DataFrame.from_records(rows, columns=columns)
 
     if args.max_value:
         df = df[(df["assessed_value"].fillna(df["taxable_value"]) <= args.max_value)]
@@ -36,5 +38,22 @@ def main():
     df.to_csv(args.out, index=False)
     print(f"✅ Wrote {len(df)} rows to {args.out}")
 
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default="contacts.db", help="SQLite path or postgresql:// URL")
+    ap.add_argument("--county", required=True)
+    ap.add_argument("--state", default="MI")
+    ap.add_argument("--max_value", type=float)
+    ap.add_argument("--min_sqft", type=float)
+    ap.add_argument("--max_sqft", type=float)
+    ap.add_argument("--year_min", type=int)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--snapshot", metavar="DIR", help="read from a snapshot_parcels.py Parquet dataset instead of --db")
+    add_profile_args(ap)
+    args = ap.parse_args()
+
+    with profile_from_args(args, "export_contacts"):
+        run(args)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,154 @@
+"""
+Parcel geometry: centroids and bounding boxes from ArcGIS features, and the
+search areas (radius, bounding box, polygon) `query_parcels` understands.
+
+Coordinates are WGS84 degrees. Areas are pruned by a spatial index on the
+parcel bounding boxes (R*Tree on SQLite, GiST on PostgreSQL, see
+storage.py) and then tested exactly against the parcel centroid.
+"""
+import math
+
+GEOMETRY_COLUMNS = ["centroid_lat", "centroid_lon", "bbox_min_lat", "bbox_min_lon", "bbox_max_lat", "bbox_max_lon"]
+
+MILES_PER_DEGREE_LAT = 69.0
+
+
+def empty_geometry():
+    return dict.fromkeys(GEOMETRY_COLUMNS)
+
+
+def point_geometry(lat, lon):
+    if lat is None or lon is None:
+        return empty_geometry()
+    return dict(zip(GEOMETRY_COLUMNS, (lat, lon, lat, lon, lat, lon)))
+
+
+def feature_geometry(geometry):
+    """Centroid and bbox of an ArcGIS JSON polygon (`rings`) or point (`x`/`y`), in lon/lat (outSR=4326)"""
+    if not geometry:
+        return empty_geometry()
+    if "x" in geometry:
+        return point_geometry(geometry.get("y"), geometry.get("x"))
+    rings = [ring for ring in geometry.get("rings") or () if len(ring) >= 3]
+    if not rings:
+        return empty_geometry()
+    xs = [p[0] for ring in rings for p in ring]
+    ys = [p[1] for ring in rings for p in ring]
+
+    # Area-weighted centroid; ArcGIS holes wind the other way, so their signed area subtracts
+    area2 = cx = cy = 0.0
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            cross = x0 * y1 - x1 * y0
+            area2 += cross
+            cx += (x0 + x1) * cross
+            cy += (y0 + y1) * cross
+    if abs(area2) > 1e-15:
+        lon, lat = cx / (3 * area2), cy / (3 * area2)
+    else:
+        lon, lat = (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+    return dict(zip(GEOMETRY_COLUMNS, (lat, lon, min(ys), min(xs), max(ys), max(xs))))
+
+
+class Radius:
+    """Parcels whose centroid lies within `miles` of (lat, lon)"""
+
+    def __init__(self, lat, lon, miles):
+        if miles <= 0:
+            raise ValueError("radius must be positive")
+        self.lat, self.lon, self.miles = lat, lon, miles
+
+    def bbox(self):
+        dlat = self.miles / MILES_PER_DEGREE_LAT
+        dlon = dlat / max(math.cos(math.radians(self.lat)), 1e-6)
+        return self.lat - dlat, self.lon - dlon, self.lat + dlat, self.lon + dlon
+
+    def where(self):
+        # Equirectangular distance: plain arithmetic, so it runs in SQL on either backend
+        k = math.cos(math.radians(self.lat))
+        return ("((centroid_lat - ?) * (centroid_lat - ?) + (centroid_lon - ?) * (centroid_lon - ?) * ?) <= ?",
+                [self.lat, self.lat, self.lon, self.lon, k * k, (self.miles / MILES_PER_DEGREE_LAT) ** 2])
+
+    def contains(self, lat, lon):
+        return True
+
+
+class BBox:
+    """Parcels whose centroid lies inside the box"""
+
+    def __init__(self, min_lat, min_lon, max_lat, max_lon):
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError("bounding box corners are out of order")
+        self.min_lat, self.min_lon, self.max_lat, self.max_lon = min_lat, min_lon, max_lat, max_lon
+
+    def bbox(self):
+        return self.min_lat, self.min_lon, self.max_lat, self.max_lon
+
+    def where(self):
+        return ("centroid_lat BETWEEN ? AND ? AND centroid_lon BETWEEN ? AND ?",
+                [self.min_lat, self.max_lat, self.min_lon, self.max_lon])
+
+    def contains(self, lat, lon):
+        return True
+
+
+class Polygon:
+    """Parcels whose centroid lies inside a simple polygon of (lat, lon) vertices"""
+
+    def __init__(self, points):
+        if len(points) < 3:
+            raise ValueError("a polygon needs at least three points")
+        self.points = [(float(lat), float(lon)) for lat, lon in points]
+
+    def bbox(self):
+        lats = [p[0] for p in self.points]
+        lons = [p[1] for p in self.points]
+        return min(lats), min(lons), max(lats), max(lons)
+
+    def where(self):
+        min_lat, min_lon, max_lat, max_lon = self.bbox()
+        return BBox(min_lat, min_lon, max_lat, max_lon).where()
+
+    def contains(self, lat, lon):
+        # Ray casting; runs only on rows the index and bbox test already kept
+        inside = False
+        pts = self.points
+        for (lat0, lon0), (lat1, lon1) in zip(pts, pts[1:] + pts[:1]):
+            if (lat0 > lat) != (lat1 > lat):
+                crossing = lon0 + (lat - lat0) * (lon1 - lon0) / (lat1 - lat0)
+                if lon < crossing:
+                    inside = not inside
+        return inside
+
+
+def _floats(text, count=None):
+    if not isinstance(text, str):
+        raise ValueError(f"expected text such as \"42.96, -85.67\", got {type(text).__name__}")
+    values = [float(v) for v in text.replace(";", ",").replace("\n", ",").split(",") if v.strip()]
+    if count is not None and len(values) != count:
+        raise ValueError(f"expected {count} numbers, got {len(values)}")
+    return values
+
+
+def parse_area(center=None, radius_miles=None, bbox=None, polygon=None):
+    """Build a search area from form/JSON values, or None when no area was given.
+
+    center: "lat, lon" (with radius_miles); bbox: "min_lat, min_lon, max_lat, max_lon";
+    polygon: "lat, lon" pairs separated by newlines or semicolons. Raises ValueError on bad input,
+    including values that are not strings (a JSON list, say); radius_miles may also be a number.
+    """
+    if polygon:
+        values = _floats(polygon)
+        if len(values) % 2:
+            raise ValueError("polygon needs lat, lon pairs")
+        return Polygon(list(zip(values[::2], values[1::2])))
+    if bbox:
+        return BBox(*_floats(bbox, 4))
+    if center:
+        if not radius_miles:
+            raise ValueError("a radius is required with a center point")
+        lat, lon = _floats(center, 2)
+        if isinstance(radius_miles, bool) or not isinstance(radius_miles, (str, int, float)):
+            raise ValueError(f"radius_miles must be a number, got {type(radius_miles).__name__}")
+        return Radius(lat, lon, float(radius_miles))
+    return None
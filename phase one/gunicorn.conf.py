@@ -0,0 +1,25 @@
+"""
+Gunicorn settings for the multi-worker serving mode (see README).
+
+Every worker process runs a few threads; each thread lazily opens its own
+SQLite connection (WAL mode, so dashboards keep reading while a campaign or
+ingest writes). Override any setting through the environment.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 4))
+# Build the app (and run schema setup) once in the master, then fork workers.
+preload_app = True
+# gthread workers heartbeat from their own loop, so this only restarts a wedged worker; it does not
+# cut off a slow request. A /send_emails request stays open for the whole send (one
+# SEND_DELAY_SECONDS pause per email), so the proxy in front must allow at least that long or the
+# client gets a timeout while the send carries on.
+timeout = int(os.environ.get("WEB_TIMEOUT", 300))
+graceful_timeout = 30
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 2000))
+max_requests_jitter = 200
+accesslog = "-"
@@ -0,0 +1,278 @@
+"""
+In-process instrumentation: latency histograms, counters, timed SQLite
+connections with slow-query logging, structured JSON logs and Prometheus
+text exposition for the `/metrics` endpoint.
+"""
+import bisect
+import contextlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("offer")
+
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", 0.25))
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+def _label_str(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    inner = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + inner + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(k, "") for k in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(k, "") for k in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels):
+        """Return (count, sum) for one label set; handy for end-of-run summaries."""
+        key = tuple(labels.get(k, "") for k in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return (series[2], series[1]) if series else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, ('le', le))} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {count}")
+        return lines
+
+
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Flask request latency",
+                         ["method", "route", "status"])
+SQL_LATENCY = Histogram("sql_statement_duration_seconds", "SQL statement latency", ["statement"])
+SLOW_QUERIES = Counter("sql_slow_queries_total", "Statements slower than SLOW_QUERY_SECONDS", ["statement"])
+ETL_STAGE = Histogram("etl_stage_duration_seconds", "ETL per-page stage latency", ["source", "stage"])
+ETL_ROWS = Counter("etl_rows_total", "Rows processed by ETL stage", ["source", "stage"])
+SMTP_LATENCY = Histogram("smtp_duration_seconds", "SMTP connect and send latency", ["operation", "outcome"])
+
+
+def render_prometheus():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Structured logging
+# ---------------------------------------------------------------------------
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        payload.update({k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS})
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def configure_logging(level=None):
+    """Attach a JSON stream handler to the `offer` logger (idempotent)."""
+    if not any(isinstance(h.formatter, JsonFormatter) for h in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level or os.environ.get("LOG_LEVEL", "INFO"))
+    return logger
+
+
+def log_event(event, level=logging.INFO, **fields):
+    logger.log(level, event, extra=fields)
+
+
+@contextlib.contextmanager
+def etl_stage(source, stage, rows=None):
+    """Time one ETL stage for one page/batch and count the rows it handled."""
+    with ETL_STAGE.time(source=source, stage=stage):
+        yield
+    if rows:
+        ETL_ROWS.inc(rows, source=source, stage=stage)
+
+
+# ---------------------------------------------------------------------------
+# Timed SQLite connections
+# ---------------------------------------------------------------------------
+
+_VERB_RE = re.compile(r"^\s*(\w+)")
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+(\w+)", re.IGNORECASE)
+
+
+def statement_label(sql):
+    """Collapse a SQL string into a low-cardinality label such as `SELECT parcels`."""
+    verb = _VERB_RE.match(sql)
+    table = _TABLE_RE.search(sql)
+    label = verb.group(1).upper() if verb else "?"
+    return f"{label} {table.group(1)}" if table else label
+
+
+def observe_sql(sql, elapsed):
+    label = statement_label(sql)
+    SQL_LATENCY.observe(elapsed, statement=label)
+    if elapsed >= SLOW_QUERY_SECONDS:
+        SLOW_QUERIES.inc(statement=label)
+        log_event("slow_query", logging.WARNING, statement=label,
+                  duration_ms=round(elapsed * 1000, 1), sql=" ".join(sql.split())[:500])
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Times each statement from execute() until its rows are exhausted.
+
+    sqlite3 steps a SELECT lazily, so most of a scan happens in fetch*() or
+    iteration; that time is added to the statement, which is recorded once
+    when its rows run out or the cursor is reused, closed or dropped.
+    """
+
+    _sql = None
+    _elapsed = 0.0
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def _finish(self):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            observe_sql(sql, self._elapsed)
+
+    def _start(self, sql):
+        self._finish()
+        self._sql, self._elapsed = sql, 0.0
+
+    def execute(self, sql, parameters=()):
+        self._start(sql)
+        self._timed(super().execute, sql, parameters)
+        if self.description is None:  # no result rows (DML/DDL): the work is done
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql)
+        self._timed(super().executemany, sql, seq_of_parameters)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(db_path, **kwargs):
+    """sqlite3.connect() whose cursors record statement latency."""
+    return sqlite3.connect(db_path, factory=TimedConnection, **kwargs)
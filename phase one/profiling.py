@@ -0,0 +1,253 @@
+"""
+Opt-in profiling for ETL runs and campaign jobs.
+
+Captures either cProfile stats or sampled stack traces, together with the
+tracemalloc peak and top allocation sites, and writes a plain-text summary
+(plus a `.prof` file for cProfile runs, loadable with `pstats`/snakeviz).
+"""
+import argparse
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+MODES = ("cprofile", "sample")
+
+# cProfile cannot be nested, so only one profiled block runs at a time.
+_active = threading.Lock()
+
+
+class StackSampler:
+    """Samples the Python stack of every thread every `interval` seconds from a background thread.
+
+    Samples are grouped by thread name, with numbered workers (`kent-fetch-0`,
+    `kent-fetch-1`, ...) pooled into one group, so pipeline stages each get
+    their own report instead of the main thread's join() dominating one.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.ticks = 0
+        self.samples = Counter()
+        self.leaf = {}
+        self.inclusive = {}
+        self._keys = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _key(self, frame):
+        code = frame.f_code
+        key = self._keys.get(code)
+        if key is None:
+            key = self._keys[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return key
+
+    @staticmethod
+    def _group(name):
+        return re.sub(r"[-_]?\d+$", "", name) or name
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            self.ticks += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                group = self._group(names.get(ident, f"thread-{ident}"))
+                self.samples[group] += 1
+                self.leaf.setdefault(group, Counter())[self._key(frame)] += 1
+                inclusive = self.inclusive.setdefault(group, Counter())
+                seen = set()
+                while frame is not None:
+                    key = self._key(frame)
+                    if key not in seen:
+                        seen.add(key)
+                        inclusive[key] += 1
+                    frame = frame.f_back
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, top):
+        lines = [f"{self.ticks} ticks every {self.interval * 1000:.1f} ms; samples by thread:"]
+        for group, n in self.samples.most_common():
+            lines.append(f"  {n:8d}  {group}")
+        for group, n in self.samples.most_common():
+            lines += ["", f"[{group}] top functions (self):"]
+            for key, count in self.leaf[group].most_common(top):
+                lines.append(f"  {count / n:6.1%}  {key}")
+            lines += ["", f"[{group}] top functions (inclusive):"]
+            for key, count in self.inclusive[group].most_common(top):
+                lines.append(f"  {count / n:6.1%}  {key}")
+        return "\n".join(lines)
+
+
+class ThreadProfiles:
+    """cProfile over the calling thread and every thread started while it is enabled.
+
+    Before Python 3.12 a cProfile.Profile only sees the thread that enabled it,
+    so `threading.setprofile` starts one more profiler inside each new thread and
+    `stats()` merges them. From 3.12 cProfile is built on sys.monitoring, which
+    already covers all threads (and allows only one active profiler).
+    """
+
+    PER_THREAD = sys.version_info < (3, 12)
+
+    def __init__(self):
+        self.main = cProfile.Profile()
+        self.workers = []
+        self._lock = threading.Lock()
+
+    def _start_in_thread(self, *_):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with self._lock:
+            self.workers.append(profiler)
+        profiler.enable()
+
+    def enable(self):
+        if self.PER_THREAD:
+            threading.setprofile(self._start_in_thread)
+        self.main.enable()
+
+    def disable(self):
+        self.main.disable()
+        if self.PER_THREAD:
+            threading.setprofile(None)
+
+    def stats(self, stream=None):
+        stats = pstats.Stats(self.main, stream=stream)
+        with self._lock:
+            for profiler in self.workers:
+                # create_stats() disables the profiler on the calling thread only, which is
+                # harmless now that the main profiler is off; the worker threads have finished
+                stats.add(profiler)
+        return stats
+
+
+class ProfileResult:
+    def __init__(self, label, mode):
+        self.label = label
+        self.mode = mode
+        self.summary_path = None
+        self.stats_path = None
+        self.wall_seconds = None
+        self.peak_bytes = None
+
+
+@contextlib.contextmanager
+def profiled(label, out_dir, mode="cprofile", top=25, interval=0.005):
+    """Profile the enclosed block and write `<out_dir>/<label>-<timestamp>.txt`.
+
+    Yields a ProfileResult, or None when another profiled block is already
+    running (the outer one keeps collecting).
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown profile mode {mode!r}; expected one of {MODES}")
+    if not _active.acquire(blocking=False):
+        yield None
+        return
+
+    result = ProfileResult(label, mode)
+    owns_tracemalloc = not tracemalloc.is_tracing()
+    if owns_tracemalloc:
+        tracemalloc.start(10)
+    tracemalloc.reset_peak()
+    profiler = sampler = None
+    if mode == "cprofile":
+        profiler = ThreadProfiles()
+        profiler.enable()
+    else:
+        sampler = StackSampler(interval)
+        sampler.start()
+    started = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result.wall_seconds = time.perf_counter() - started
+        if profiler:
+            profiler.disable()
+        if sampler:
+            sampler.stop()
+        current, result.peak_bytes = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if owns_tracemalloc:
+            tracemalloc.stop()
+        try:
+            _write_summary(result, out_dir, top, profiler, sampler, current, snapshot)
+        finally:
+            _active.release()
+
+
+def _write_summary(result, out_dir, top, profiler, sampler, current_bytes, snapshot):
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.join(out_dir, f"{result.label}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}")
+    lines = [
+        f"Profile: {result.label}",
+        f"Mode: {result.mode}",
+        f"Wall time: {result.wall_seconds:.3f}s",
+        f"tracemalloc peak: {result.peak_bytes / 2**20:.2f} MiB (still allocated at end: {current_bytes / 2**20:.2f} MiB)",
+        "",
+    ]
+    if profiler:
+        result.stats_path = stem + ".prof"
+        buf = io.StringIO()
+        stats = profiler.stats(stream=buf)
+        stats.dump_stats(result.stats_path)
+        stats.strip_dirs()
+        for sort_key in ("cumulative", "tottime"):
+            buf.seek(0)
+            buf.truncate()
+            stats.sort_stats(sort_key).print_stats(top)
+            lines += [f"Top functions by {sort_key} (all threads):", buf.getvalue().strip(), ""]
+    if sampler:
+        lines += [sampler.report(top), ""]
+    lines.append("Top allocation sites (live at end of run):")
+    for stat in snapshot.statistics("lineno")[:top]:
+        frame = stat.traceback[0]
+        lines.append(f"  {stat.size / 1024:10.1f} KiB  {stat.count:8d} blocks  "
+                     f"{os.path.basename(frame.filename)}:{frame.lineno}")
+    result.summary_path = stem + ".txt"
+    with open(result.summary_path, "w") as fh:
+        fh.write("\n".join(lines) + "\n")
+
+
+def add_profile_args(ap):
+    ap.add_argument("--profile", metavar="DIR", help="profile this run and write a summary into DIR")
+    ap.add_argument("--profile_mode", choices=MODES, default="cprofile",
+                    help="cprofile (deterministic) or sample (low-overhead stack sampling)")
+    ap.add_argument("--profile_top", type=int, default=25, help="functions/allocations listed in the summary")
+
+
+@contextlib.contextmanager
+def profile_from_args(args, label):
+    """Profile the block when the script was started with `--profile DIR`."""
+    if not getattr(args, "profile", None):
+        yield None
+        return
+    with profiled(label, args.profile, mode=args.profile_mode, top=args.profile_top) as result:
+        yield result
+    if result:
+        print(f"🔎 Profile summary written to {result.summary_path}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Print a saved cProfile .prof file")
+    ap.add_argument("stats")
+    ap.add_argument("--sort", default="cumulative")
+    ap.add_argument("--top", type=int, default=25)
+    cli = ap.parse_args()
+    pstats.Stats(cli.stats).strip_dirs().sort_stats(cli.sort).print_stats(cli.top)
@@ -1,19 +1,29 @@
+"""
+One-shot local setup: create the schema, load every county once, then start the dev server.
+Recurring refreshes belong to scheduler.py; see schedule.json.
+"""
+import os
 import subprocess
 import sys
 
 # Change to your virtualenv Python if needed
 PYTHON = sys.executable
+DB = os.environ.get("DATABASE_URL") or os.environ.get("DB_FILE", "contacts.db")
+OTTAWA_CSV = os.environ.get("OTTAWA_CSV")  # Ottawa's Parcel Data Export, if downloaded
 
+# ETL steps load into staging and publish atomically, so a running app keeps serving the old data
 steps = [
-    [PYTHON, "schema_parcels.py"],
-    [PYTHON, "etl_kent_mi.py", "--db", "contacts.db", "--max_pages", "999"],
-    [PYTHON, "etl_ottawa_mi.py", "--db", "contacts.db", "--pagesize", "2000", "--max_pages", "999"],
-    [PYTHON, "app.py"]
+    [PYTHON, "schema_parcels.py", "--db", DB],
+    [PYTHON, "etl_kent_mi.py", "--db", DB, "--max_pages", "999", "--staging"],
 ]
+if OTTAWA_CSV:
+    steps.append([PYTHON, "etl_ottawa_mi_from_csv.py", "--db", DB, "--csv", OTTAWA_CSV, "--staging"])
+# Replit's Run button and deployments reach the app on 0.0.0.0:5000 (see .replit); debug stays off
+steps.append([PYTHON, "app.py", "--host", os.environ.get("HOST", "0.0.0.0")])
 
 for step in steps:
     print(f"\n🚀 Running: {' '.join(step)}")
     result = subprocess.run(step)
     if result.returncode != 0:
         print(f"❌ Step failed: {' '.join(step)}")
-        sys.exit(result.returncode)code)
+        sys.exit(result.returncode)
@@ -0,0 +1,414 @@
+"""
+Long-running ingest scheduler: refreshes each county on its own cadence instead of
+someone running `run_all.py` by hand.
+
+Each county in the config (schedule.json) is a job with a cadence, a priority,
+a fetch concurrency and a request budget for its upstream server. Jobs run as
+subprocesses of the ETL scripts (so a crash or a leak in one load cannot take
+the scheduler down), and every run is recorded with its timing, outcome and
+row count in the `ingest_runs` table of the same database the ETLs load.
+
+Scheduling:
+  * a county that comes due while its previous run is still going gets a
+    `skipped` run instead of a second copy;
+  * at most `max_jobs` loads run at once; due counties are started by
+    priority, then by response ratio ((waiting + expected) / expected, from
+    their recent run times), so a quick county that has waited a little
+    overtakes a long one, and a long one still gets its turn as it waits;
+  * counties expected to run longer than `long_job_minutes` never take the
+    last `small_job_slots` slots, so a big county cannot starve the small ones.
+
+    python scheduler.py --config schedule.json --db contacts.db
+    python scheduler.py --once --force          # refresh everything now and exit
+    python scheduler.py --history
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import storage
+from metrics import configure_logging, log_event
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MIGRATIONS = [
+    ("scheduler_0001_ingest_runs", '''
+        CREATE TABLE IF NOT EXISTS ingest_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            county TEXT,
+            state TEXT,
+            status TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            seconds REAL,
+            exit_code INTEGER,
+            row_count INTEGER,
+            pid INTEGER,
+            log_path TEXT,
+            message TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_ingest_runs_job ON ingest_runs (job, started_at);
+    '''),
+]
+
+DEFAULT_EXPECTED_MINUTES = 10
+
+# Scripts that take --fetchers and --max_rpm, which max_concurrency and request_budget_per_minute map to;
+# the CSV loaders make a single download and reject both
+FETCH_SCRIPTS = {"etl_kent_mi.py"}
+
+
+class Job:
+    """One county's schedule entry"""
+
+    def __init__(self, name, script, county=None, state=None, args=(), every_hours=24, priority=0,
+                 max_concurrency=None, request_budget_per_minute=None, timeout_minutes=None,
+                 expected_minutes=DEFAULT_EXPECTED_MINUTES, enabled=True):
+        if not os.path.exists(os.path.join(HERE, script)):
+            raise ValueError(f"job {name!r}: no such script {script}")
+        if every_hours <= 0:
+            raise ValueError(f"job {name!r}: every_hours must be positive")
+        if (max_concurrency or request_budget_per_minute) and script not in FETCH_SCRIPTS:
+            raise ValueError(f"job {name!r}: {script} takes no max_concurrency or request_budget_per_minute")
+        self.name = name
+        self.script = script
+        self.county = county
+        self.state = state
+        self.args = [str(a) for a in args]
+        self.cadence = every_hours * 3600
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        self.request_budget = request_budget_per_minute
+        self.timeout = timeout_minutes * 60 if timeout_minutes else None
+        self.default_expected = expected_minutes * 60
+        self.enabled = enabled
+
+    def command(self, python, db):
+        cmd = [python, self.script, "--db", db] + self.args
+        if self.max_concurrency:
+            cmd += ["--fetchers", str(self.max_concurrency)]
+        if self.request_budget:
+            cmd += ["--max_rpm", str(self.request_budget)]
+        return cmd
+
+
+def load_config(path):
+    """(settings, jobs) from a schedule.json; raises SystemExit on a malformed file"""
+    try:
+        with open(path) as fh:
+            config = json.load(fh)
+        jobs = [Job(**entry) for entry in config.get("counties", [])]
+    except (OSError, ValueError, TypeError) as e:
+        raise SystemExit(f"❌ Bad schedule config {path}: {e}")
+    names = [j.name for j in jobs]
+    if len(set(names)) != len(names):
+        raise SystemExit(f"❌ Bad schedule config {path}: job names must be unique")
+    settings = {k: v for k, v in config.items() if k != "counties"}
+    return settings, jobs
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _outcome(log_path):
+    """(row_count, last line) from a finished job's log: the ETLs' JSON events say how many rows went live"""
+    rows, last = None, None
+    try:
+        with open(log_path, "rb") as fh:
+            fh.seek(max(0, os.path.getsize(log_path) - 256 * 1024))
+            lines = fh.read().decode("utf-8", "replace").splitlines()
+    except OSError:
+        return rows, last
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        last = line
+        if line.startswith("{"):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("event") == "staging_published":
+                rows = event.get("published")
+            elif event.get("event") == "etl_complete" and rows is None:
+                rows = event.get("rows")
+    return rows, last
+
+
+class Run:
+    def __init__(self, run_id, job, proc, started, log_path):
+        self.id = run_id
+        self.job = job
+        self.proc = proc
+        self.started = started
+        self.log_path = log_path
+
+
+class Scheduler:
+    def __init__(self, db, jobs, max_jobs=2, long_job_minutes=30, small_job_slots=1, tick_seconds=15,
+                 log_dir="logs/ingest", python=sys.executable, once=False, force=False):
+        # Jobs run with cwd=HERE, so a relative SQLite path must be pinned down here or the children
+        # would load a different database than the one ingest_runs is written to
+        self.db = db if storage.is_postgres(db) else os.path.abspath(db)
+        self.backend = storage.get_backend(self.db)
+        self.jobs = [j for j in jobs if j.enabled]
+        self.max_jobs = max(1, max_jobs)
+        self.long_job = long_job_minutes * 60
+        self.small_job_slots = min(small_job_slots, self.max_jobs - 1)
+        self.tick = tick_seconds
+        self.log_dir = log_dir
+        self.python = python
+        self.once = once
+        self.force = force
+        self.running = {}    # job name -> Run started by this process
+        self.external = {}   # job name -> pid of a run left by an earlier scheduler that is still alive
+        self.last_started = {}
+        self.launched = set()
+        self.started_at = time.time()
+        self.stopping = threading.Event()
+
+    # -- run history ----------------------------------------------------------------------------
+
+    def _connect(self):
+        return self.backend.connect()
+
+    def prepare(self):
+        """Create ingest_runs, and settle runs a previous scheduler left marked as running"""
+        conn = self._connect()
+        try:
+            with self.backend.schema_lock(conn):
+                storage.apply_migrations(conn, MIGRATIONS)
+            now = time.time()
+            stale = conn.execute("SELECT id, job, pid, started_at FROM ingest_runs WHERE status = 'running'").fetchall()
+            for row in stale:
+                if row["pid"] and _pid_alive(row["pid"]):
+                    self.external[row["job"]] = row["pid"]
+                else:
+                    conn.execute("UPDATE ingest_runs SET status = 'abandoned', finished_at = ?, seconds = ?, "
+                                 "message = 'scheduler exited while the run was in progress' WHERE id = ?",
+                                 (now, now - row["started_at"], row["id"]))
+            self.last_started = {row[0]: row[1] for row in conn.execute(
+                "SELECT job, MAX(started_at) FROM ingest_runs GROUP BY job").fetchall()}
+            conn.commit()
+        finally:
+            conn.close()
+
+    def expected_seconds(self, job):
+        """Mean of the last five successful runs, or the configured guess before there are any"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT seconds FROM ingest_runs WHERE job = ? AND status = 'succeeded' "
+                                "ORDER BY started_at DESC LIMIT 5", (job.name,)).fetchall()
+        finally:
+            conn.close()
+        return sum(r[0] for r in rows) / len(rows) if rows else job.default_expected
+
+    def _record(self, sql, params, returning=False):
+        conn = self._connect()
+        try:
+            cur = conn.execute(sql, params)
+            run_id = cur.fetchone()[0] if returning else None
+            conn.commit()
+            return run_id
+        finally:
+            conn.close()
+
+    # -- scheduling -----------------------------------------------------------------------------
+
+    def due_at(self, job):
+        if self.once and job.name in self.launched:
+            return None
+        last = self.last_started.get(job.name)
+        if last is None or (self.force and job.name not in self.launched):
+            return self.started_at  # never run (or forced): due as soon as the scheduler starts
+        return last + job.cadence
+
+    def busy(self, job):
+        if job.name in self.running:
+            return True
+        pid = self.external.get(job.name)
+        if pid and _pid_alive(pid):
+            return True
+        self.external.pop(job.name, None)
+        return False
+
+    def due(self, now):
+        return [j for j in self.jobs if (at := self.due_at(j)) is not None and at <= now]
+
+    def step(self, now=None):
+        """Reap finished runs, record skips and start whatever is due and fits; returns seconds to sleep"""
+        self.reap()
+        now = now or time.time()
+        due = self.due(now)
+        ready = []
+        for job in due:
+            if self.busy(job):
+                self.skip(job, now)
+            else:
+                ready.append(job)
+
+        expected = {j.name: self.expected_seconds(j) for j in ready}
+        ratio = lambda j: (now - self.due_at(j) + expected[j.name]) / max(expected[j.name], 1.0)
+        ready.sort(key=lambda j: (-j.priority, -ratio(j)))
+        long_running = sum(1 for r in self.running.values() if self.expected_seconds(r.job) >= self.long_job)
+        for job in ready:
+            if len(self.running) >= self.max_jobs:
+                break
+            if expected[job.name] >= self.long_job:
+                if long_running >= self.max_jobs - self.small_job_slots:
+                    continue  # keep a slot for the small counties
+                long_running += 1
+            self.launch(job, now)
+
+        upcoming = [at for j in self.jobs if (at := self.due_at(j)) is not None and at > now]
+        return max(1.0, min([self.tick] + [at - now for at in upcoming]))
+
+    def skip(self, job, now):
+        self.last_started[job.name] = now
+        self.launched.add(job.name)
+        self._record("INSERT INTO ingest_runs (job, county, state, status, started_at, finished_at, seconds, message) "
+                     "VALUES (?, ?, ?, 'skipped', ?, ?, 0, 'previous run still in progress')",
+                     (job.name, job.county, job.state, now, now))
+        log_event("ingest_skipped", logging.WARNING, job=job.name, reason="previous run still in progress")
+
+    def launch(self, job, now):
+        run_id = self._record("INSERT INTO ingest_runs (job, county, state, status, started_at) "
+                              "VALUES (?, ?, ?, 'running', ?) RETURNING id",
+                              (job.name, job.county, job.state, now), returning=True)
+        os.makedirs(self.log_dir, exist_ok=True)
+        log_path = os.path.abspath(os.path.join(self.log_dir, f"{job.name}-{run_id}.log"))
+        cmd = job.command(self.python, self.db)
+        with open(log_path, "ab") as log:
+            # Own session, so a timeout or shutdown can signal the whole job
+            proc = subprocess.Popen(cmd, cwd=HERE, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        self._record("UPDATE ingest_runs SET pid = ?, log_path = ? WHERE id = ?", (proc.pid, log_path, run_id))
+        self.running[job.name] = Run(run_id, job, proc, now, log_path)
+        self.last_started[job.name] = now
+        self.launched.add(job.name)
+        log_event("ingest_started", job=job.name, run_id=run_id, pid=proc.pid, command=" ".join(cmd))
+
+    def reap(self):
+        for name, run in list(self.running.items()):
+            code = run.proc.poll()
+            if code is None:
+                if run.job.timeout and time.time() - run.started > run.job.timeout:
+                    self._signal(run, signal.SIGKILL)
+                    run.proc.wait()
+                    self.finish(run, "timeout", f"killed after {run.job.timeout:.0f}s")
+                continue
+            self.finish(run, "succeeded" if code == 0 else "failed")
+
+    def finish(self, run, status, message=None):
+        del self.running[run.job.name]
+        finished = time.time()
+        rows, last_line = _outcome(run.log_path)
+        if message is None and status != "succeeded":
+            message = last_line
+        self._record("UPDATE ingest_runs SET status = ?, finished_at = ?, seconds = ?, exit_code = ?, "
+                     "row_count = ?, message = ? WHERE id = ?",
+                     (status, finished, round(finished - run.started, 3), run.proc.returncode, rows, message, run.id))
+        log_event("ingest_finished", logging.INFO if status == "succeeded" else logging.ERROR,
+                  job=run.job.name, run_id=run.id, status=status, seconds=round(finished - run.started, 3),
+                  rows=rows, exit_code=run.proc.returncode)
+
+    @staticmethod
+    def _signal(run, sig):
+        try:
+            os.killpg(run.proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def shutdown(self, grace=30):
+        """Stop running jobs. Staged loads publish atomically, so an interrupted one leaves the live data as it was"""
+        for run in self.running.values():
+            self._signal(run, signal.SIGTERM)
+        deadline = time.time() + grace
+        for run in list(self.running.values()):
+            try:
+                run.proc.wait(timeout=max(0.0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                self._signal(run, signal.SIGKILL)
+                run.proc.wait()
+            self.finish(run, "cancelled", "scheduler shut down")
+
+    def serve(self):
+        self.prepare()
+        log_event("scheduler_started", jobs=[j.name for j in self.jobs], max_jobs=self.max_jobs, once=self.once)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: self.stopping.set())
+        try:
+            while not self.stopping.is_set():
+                wait = self.step()
+                if self.once and not self.running and not self.due(time.time()):
+                    break
+                self.stopping.wait(min(wait, 1.0) if self.running else wait)
+        finally:
+            self.shutdown()
+        log_event("scheduler_stopped")
+
+
+def print_history(db, limit=20):
+    backend = storage.get_backend(db)
+    conn = backend.connect()
+    try:
+        with backend.schema_lock(conn):
+            storage.apply_migrations(conn, MIGRATIONS)
+        rows = conn.execute("SELECT job, status, started_at, seconds, row_count, message FROM ingest_runs "
+                            "ORDER BY started_at DESC LIMIT ?", (limit,)).fetchall()
+    finally:
+        conn.close()
+    print(f"{'job':<12} {'status':<10} {'started':<19} {'seconds':>9} {'rows':>8}  message")
+    for r in rows:
+        started = datetime.fromtimestamp(r["started_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        seconds = f"{r['seconds']:.1f}" if r["seconds"] is not None else "-"
+        count = r["row_count"] if r["row_count"] is not None else "-"
+        print(f"{r['job']:<12} {r['status']:<10} {started:<19} {seconds:>9} {count:>8}  {r['message'] or ''}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run county ingests on a schedule")
+    ap.add_argument("--config", default=os.path.join(HERE, "schedule.json"))
+    ap.add_argument("--db", default=os.environ.get("DATABASE_URL") or os.environ.get("DB_FILE", "contacts.db"),
+                    help="SQLite path or postgresql:// URL (default $DATABASE_URL, then $DB_FILE)")
+    ap.add_argument("--log_dir", default=None, help="per-run job output (default logs/ingest)")
+    ap.add_argument("--once", action="store_true", help="run what is due, wait for it, then exit")
+    ap.add_argument("--force", action="store_true", help="treat every county as due now")
+    ap.add_argument("--history", action="store_true", help="print recent runs and exit")
+    ap.add_argument("--limit", type=int, default=20, help="runs shown by --history")
+    args = ap.parse_args()
+
+    if args.history:
+        print_history(args.db, args.limit)
+        return
+    configure_logging()
+    settings, jobs = load_config(args.config)
+    if not any(j.enabled for j in jobs):
+        raise SystemExit(f"❌ No enabled counties in {args.config}")
+    scheduler = Scheduler(args.db, jobs,
+                          max_jobs=settings.get("max_jobs", 2),
+                          long_job_minutes=settings.get("long_job_minutes", 30),
+                          small_job_slots=settings.get("small_job_slots", 1),
+                          tick_seconds=settings.get("tick_seconds", 15),
+                          log_dir=args.log_dir or settings.get("log_dir", "logs/ingest"),
+                          once=args.once, force=args.force)
+    scheduler.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 """
-Creates/updates a `parcels` table in contacts.db
+Creates/updates a `parcels` table in contacts.db (or any storage.py target)
 """
-import sqlite3
+import storage
+from geo import GEOMETRY_COLUMNS
 
 DB_FILE = "contacts.db"
 
+# Every parcels column except the rowid, in table order; ETL rows are tuples in this order
+PARCEL_COLUMNS = [
+    "county", "state", "parcel_id", "situs_address", "city", "zip_code", "property_class", "owner_name",
+    "mailing_address1", "mailing_city", "mailing_state", "mailing_zip", "land_sqft", "building_sqft",
+    "assessed_value", "taxable_value", "year_built", "source", "source_updated_at",
+] + GEOMETRY_COLUMNS
+
 PARCELS_SCHEMA = """
 CREATE TABLE IF NOT EXISTS parcels (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -31,13 +39,71 @@ CREATE TABLE IF NOT EXISTS parcels (
 CREATE INDEX IF NOT EXISTS idx_parcels_county_state ON parcels(county, state);
 """
 
+GEOMETRY_SCHEMA = "\n".join(f"ALTER TABLE parcels ADD COLUMN {c} REAL;" for c in GEOMETRY_COLUMNS)
+
+# SQLite: an R*Tree over parcel bounding boxes, kept in sync with parcels by triggers so every
+# writer (upserts, bulk loads, deletes) maintains it
+SQLITE_SPATIAL_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS parcels_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat);
+INSERT INTO parcels_rtree (id, min_lon, max_lon, min_lat, max_lat)
+    SELECT id, bbox_min_lon, bbox_max_lon, bbox_min_lat, bbox_max_lat FROM parcels WHERE bbox_min_lon IS NOT NULL;
+CREATE TRIGGER IF NOT EXISTS parcels_rtree_insert AFTER INSERT ON parcels
+WHEN NEW.bbox_min_lon IS NOT NULL BEGIN
+    INSERT INTO parcels_rtree VALUES (NEW.id, NEW.bbox_min_lon, NEW.bbox_max_lon, NEW.bbox_min_lat, NEW.bbox_max_lat);
+END;
+CREATE TRIGGER IF NOT EXISTS parcels_rtree_update
+AFTER UPDATE OF bbox_min_lon, bbox_max_lon, bbox_min_lat, bbox_max_lat ON parcels
+WHEN NEW.bbox_min_lon IS NOT OLD.bbox_min_lon OR NEW.bbox_max_lon IS NOT OLD.bbox_max_lon
+  OR NEW.bbox_min_lat IS NOT OLD.bbox_min_lat OR NEW.bbox_max_lat IS NOT OLD.bbox_max_lat BEGIN
+    DELETE FROM parcels_rtree WHERE id = OLD.id;
+    INSERT INTO parcels_rtree SELECT NEW.id, NEW.bbox_min_lon, NEW.bbox_max_lon, NEW.bbox_min_lat, NEW.bbox_max_lat
+        WHERE NEW.bbox_min_lon IS NOT NULL;
+END;
+CREATE TRIGGER IF NOT EXISTS parcels_rtree_delete AFTER DELETE ON parcels BEGIN
+    DELETE FROM parcels_rtree WHERE id = OLD.id;
+END;
+"""
+
+# PostgreSQL: a GiST expression index on the built-in box type (no PostGIS needed)
+PG_BBOX = "box(point(bbox_min_lon, bbox_min_lat), point(bbox_max_lon, bbox_max_lat))"
+POSTGRES_SPATIAL_INDEX = f"CREATE INDEX IF NOT EXISTS idx_parcels_bbox ON parcels USING gist (({PG_BBOX}));"
+
+def create_spatial_index(conn, backend):
+    backend.executescript(conn, SQLITE_SPATIAL_INDEX if backend.name == "sqlite" else POSTGRES_SPATIAL_INDEX)
+
+def spatial_filter(backend, min_lat, min_lon, max_lat, max_lon):
+    """(FROM clause, WHERE condition, params) selecting parcels whose bbox intersects the box via the index"""
+    if backend.name == "sqlite":
+        # CROSS JOIN pins the R*Tree as the outer loop; otherwise a county filter can win and probe it per row
+        return ("parcels_rtree r CROSS JOIN parcels ON parcels.id = r.id",
+                "r.min_lon <= ? AND r.max_lon >= ? AND r.min_lat <= ? AND r.max_lat >= ?",
+                [max_lon, min_lon, max_lat, min_lat])
+    return "parcels", f"{PG_BBOX} && box(point(?, ?), point(?, ?))", [min_lon, min_lat, max_lon, max_lat]
+
+# Applied in order, once per database; never edit an entry that has shipped, append a new one
+MIGRATIONS = [
+    ("parcels_0001_create", PARCELS_SCHEMA),
+    ("parcels_0002_parcel_key_index",
+     "CREATE INDEX IF NOT EXISTS idx_parcels_parcel_key ON parcels(county, state, parcel_id);"),
+    ("parcels_0003_geometry", GEOMETRY_SCHEMA),
+    ("parcels_0004_spatial_index", create_spatial_index),
+]
+
+def parcel_tuple(row):
+    return tuple(row.get(c) for c in PARCEL_COLUMNS)
+
 def ensure_db(db_path: str = DB_FILE):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.executescript(PARCELS_SCHEMA)
-    conn.commit()
-    conn.close()
+    backend = storage.get_backend(db_path)
+    conn = backend.connect()
+    try:
+        with backend.schema_lock(conn):
+            storage.apply_migrations(conn, MIGRATIONS)
+    finally:
+        conn.close()
     print(f"✅ parcels table ready in {db_path}")
 
 if __name__ == "__main__":
-    ensure_db()()
+    import argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=DB_FILE, help="SQLite path or postgresql:// URL")
+    ensure_db(ap.parse_args().db)
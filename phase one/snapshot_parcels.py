@@ -0,0 +1,226 @@
+"""
+Columnar snapshot of the `parcels` table for offline analysis.
+
+Streams `parcels` out of the database in batches into a Hive-partitioned Parquet
+dataset (state=XX/county=YY/...) with typed numeric columns and
+dictionary-encoded low-cardinality strings. `read_snapshot` filters the
+dataset with partition pruning and row-group predicate pushdown, and is what
+`export_contacts.py --snapshot` uses.
+
+    python snapshot_parcels.py --db contacts.db --out snapshots/parcels
+"""
+import argparse
+import functools
+import json
+import operator
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+import storage
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # optional dependency: pip install "repl-nix-workspace[snapshot]"
+    pa = ds = None
+
+DICT_STRING = "dict"
+COLUMNS = [
+    ("id", "int64"),
+    ("county", DICT_STRING),
+    ("state", DICT_STRING),
+    ("parcel_id", "string"),
+    ("situs_address", "string"),
+    ("city", DICT_STRING),
+    ("zip_code", DICT_STRING),
+    ("property_class", DICT_STRING),
+    ("owner_name", "string"),
+    ("mailing_address1", "string"),
+    ("mailing_city", DICT_STRING),
+    ("mailing_state", DICT_STRING),
+    ("mailing_zip", DICT_STRING),
+    ("land_sqft", "float64"),
+    ("building_sqft", "float64"),
+    ("assessed_value", "float64"),
+    ("taxable_value", "float64"),
+    ("year_built", "int32"),
+    ("source", DICT_STRING),
+    ("source_updated_at", "string"),
+    ("centroid_lat", "float64"),
+    ("centroid_lon", "float64"),
+    ("bbox_min_lat", "float64"),
+    ("bbox_min_lon", "float64"),
+    ("bbox_max_lat", "float64"),
+    ("bbox_max_lon", "float64"),
+]
+PARTITION_COLUMNS = ["state", "county"]
+MANIFEST = "_snapshot.json"
+
+
+def require_pyarrow():
+    if pa is None:
+        raise SystemExit("❌ pyarrow is required for Parquet snapshots: pip install pyarrow")
+
+
+def arrow_schema():
+    require_pyarrow()
+    types = {
+        DICT_STRING: pa.dictionary(pa.int32(), pa.string()),
+        "string": pa.string(),
+        "int64": pa.int64(),
+        "int32": pa.int32(),
+        "float64": pa.float64(),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in COLUMNS])
+
+
+def partitioning():
+    return ds.partitioning(pa.schema([(c, pa.string()) for c in PARTITION_COLUMNS]), flavor="hive")
+
+
+def _num(value, cast):
+    # Ottawa rows are stored from CSV text, so numeric columns may hold '' or '1,234'
+    if value is None or value == "":
+        return None
+    try:
+        number = float(str(value).replace(",", ""))
+    except ValueError:
+        return None
+    return int(number) if cast is int else number
+
+
+def _batch(rows, schema):
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    arrays = []
+    for (name, kind), values, field in zip(COLUMNS, columns, schema):
+        if kind == "float64":
+            values = [_num(v, float) for v in values]
+        elif kind == "int32":
+            values = [_num(v, int) for v in values]
+        elif kind in ("string", DICT_STRING):
+            values = [None if v is None else str(v) for v in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def iter_batches(db, batch_size=50000):
+    """Stream parcels out of the database as Arrow record batches, ordered so partitions stay contiguous"""
+    schema = arrow_schema()
+    backend = storage.get_backend(db)
+    conn = backend.connect()
+    try:
+        sql = f"SELECT {', '.join(n for n, _ in COLUMNS)} FROM parcels ORDER BY county, state"
+        for rows in backend.iter_batches(conn, sql, batch_size=batch_size):
+            yield _batch(rows, schema)
+    finally:
+        conn.close()
+
+
+def write_snapshot(db, out_dir, batch_size=50000, row_group_size=100000):
+    """Write a fresh snapshot next to `out_dir`, then swap it into place"""
+    schema = arrow_schema()
+    staging = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    counter = {"rows": 0}
+
+    def counted():
+        for batch in iter_batches(db, batch_size):
+            counter["rows"] += batch.num_rows
+            yield batch
+
+    ds.write_dataset(
+        counted(), staging, schema=schema, format="parquet",
+        partitioning=partitioning(),
+        basename_template="part-{i}.parquet",
+        max_rows_per_group=row_group_size,
+        min_rows_per_group=min(row_group_size, batch_size),
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+    )
+    os.makedirs(staging, exist_ok=True)  # write_dataset creates nothing for an empty table
+    with open(os.path.join(staging, MANIFEST), "w") as fh:
+        json.dump({
+            "source_db": db if storage.is_postgres(db) else os.path.abspath(db),
+            "rows": counter["rows"],
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "partitioning": PARTITION_COLUMNS,
+        }, fh, indent=2)
+
+    previous = out_dir.rstrip("/") + ".old"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.rename(out_dir, previous)
+    os.rename(staging, out_dir)
+    shutil.rmtree(previous, ignore_errors=True)
+    return counter["rows"]
+
+
+def _at_least(name, bound, default):
+    # coalesce(name, default) >= bound, written on the bare column so row-group statistics can prune it
+    expr = ds.field(name) >= bound
+    return expr | ds.field(name).is_null() if default >= bound else expr
+
+
+def _at_most(name, bound, default):
+    expr = ds.field(name) <= bound
+    return expr | ds.field(name).is_null() if default <= bound else expr
+
+
+def value_filter(max_value=None, min_sqft=None, max_sqft=None, year_min=None):
+    """The column part of snapshot_filter, or None when there is nothing to filter on.
+
+    The fallbacks export_contacts.py applies to missing values are spelled out as
+    is_null() branches instead of coalesce(): a computed column has no Parquet
+    statistics, so it would disable row-group pruning.
+    """
+    terms = []
+    if max_value:
+        terms.append((ds.field("assessed_value") <= max_value) | (
+            ds.field("assessed_value").is_null() & (ds.field("taxable_value") <= max_value)))
+    if min_sqft:
+        terms.append(_at_least("building_sqft", min_sqft, 0))
+    if max_sqft:
+        terms.append(_at_most("building_sqft", max_sqft, 0))
+    if year_min:
+        terms.append(_at_least("year_built", year_min, 0))
+    return functools.reduce(operator.and_, terms) if terms else None
+
+
+def snapshot_filter(county, state, max_value=None, min_sqft=None, max_sqft=None, year_min=None):
+    """Dataset filter matching export_contacts.py's pandas filters"""
+    expr = (ds.field("county") == county) & (ds.field("state") == state)
+    values = value_filter(max_value, min_sqft, max_sqft, year_min)
+    return expr if values is None else expr & values
+
+
+def read_snapshot(snapshot_dir, county, state, max_value=None, min_sqft=None, max_sqft=None, year_min=None):
+    """Return a pandas DataFrame of matching parcels, in `parcels` column order"""
+    require_pyarrow()
+    dataset = ds.dataset(snapshot_dir, format="parquet", partitioning=partitioning(),
+                         exclude_invalid_files=True, ignore_prefixes=[".", "_"])
+    table = dataset.to_table(
+        columns=[name for name, _ in COLUMNS],
+        filter=snapshot_filter(county, state, max_value, min_sqft, max_sqft, year_min),
+    )
+    return table.to_pandas()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default="contacts.db", help="SQLite path or postgresql:// URL")
+    ap.add_argument("--out", default="snapshots/parcels")
+    ap.add_argument("--batch_size", type=int, default=50000)
+    ap.add_argument("--row_group_size", type=int, default=100000)
+    args = ap.parse_args()
+
+    require_pyarrow()
+    started = time.perf_counter()
+    rows = write_snapshot(args.db, args.out, args.batch_size, args.row_group_size)
+    size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(args.out) for f in files)
+    print(f"✅ Snapshot of {rows} parcels written to {args.out} "
+          f"({size / 2**20:.1f} MiB) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Content-addressed on-disk cache of raw source responses (FeatureServer pages, CSV exports).
+
+Bodies are stored once per SHA-256 of their content under `objects/`,
+compressed with zstd when `zstandard` is installed and gzip otherwise.
+A small SQLite index maps (source, url, query parameters) to the
+object. Entries older than the TTL are refetched, and eviction drops
+expired entries and then the least recently used ones until the cache
+fits its size budget.
+
+With `offline=True` (the ETLs' `--replay`), lookups never touch the network
+and ignore the TTL, so a database can be rebuilt from a previous crawl.
+
+    python source_cache.py --cache .source_cache stats
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from metrics import Counter
+
+try:
+    import zstandard
+except ImportError:  # optional dependency: pip install "repl-nix-workspace[cache]"
+    zstandard = None
+
+CACHE_REQUESTS = Counter("source_cache_requests_total", "Raw source cache lookups", ["source", "outcome"])
+
+DEFAULT_TTL_HOURS = 24 * 7
+DEFAULT_MAX_MB = 2048
+
+
+class CacheMiss(LookupError):
+    """An offline (replay) lookup found nothing cached for the request"""
+
+
+def request_key(source, url, params):
+    canonical = json.dumps({"source": source, "url": url, "params": params or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class SourceCache:
+    def __init__(self, root, ttl_hours=DEFAULT_TTL_HOURS, max_mb=DEFAULT_MAX_MB, codec=None):
+        self.root = root
+        self.ttl = ttl_hours * 3600 if ttl_hours else None
+        self.max_bytes = int(max_mb * 2**20) if max_mb else None
+        self.codec = codec or ("zst" if zstandard else "gz")
+        if self.codec == "zst" and zstandard is None:
+            raise RuntimeError("zstd compression needs zstandard: pip install zstandard")
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.db"), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                source TEXT,
+                url TEXT,
+                params TEXT,
+                object TEXT,
+                raw_bytes INTEGER,
+                fetched_at REAL,
+                accessed_at REAL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS objects (
+                object TEXT PRIMARY KEY,
+                path TEXT,
+                stored_bytes INTEGER
+            )
+        """)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    # -- objects ----------------------------------------------------------------------------
+
+    def _compress(self, body):
+        if self.codec == "zst":
+            return zstandard.ZstdCompressor(level=3).compress(body)
+        return gzip.compress(body, compresslevel=6)
+
+    @staticmethod
+    def _decompress(path, data):
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"{path} is zstd-compressed; pip install zstandard to read it")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def _store(self, digest, data):
+        """Write compressed data once under its content hash; returns (relative path, stored bytes)"""
+        row = self._db.execute("SELECT path, stored_bytes FROM objects WHERE object = ?", (digest,)).fetchone()
+        if row and os.path.exists(os.path.join(self.root, row[0])):
+            return row
+        rel = os.path.join("objects", digest[:2], f"{digest}.{self.codec}")
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        return rel, len(data)
+
+    # -- entries ----------------------------------------------------------------------------
+
+    def get(self, source, url, params=None, allow_stale=False):
+        """Cached body for the request, or None when missing (or expired, unless allow_stale)"""
+        key = request_key(source, url, params)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT e.fetched_at, o.path FROM entries e JOIN objects o ON o.object = e.object WHERE e.key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            fetched_at, rel = row
+            if not allow_stale and self.ttl and time.time() - fetched_at > self.ttl:
+                return None
+            try:
+                with open(os.path.join(self.root, rel), "rb") as fh:
+                    data = fh.read()
+            except FileNotFoundError:
+                return None
+            self._db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return self._decompress(rel, data)
+
+    def put(self, source, url, params, body):
+        key = request_key(source, url, params)
+        digest = hashlib.sha256(body).hexdigest()
+        data = self._compress(body)  # outside the lock, so concurrent fetchers compress in parallel
+        now = time.time()
+        with self._lock:
+            rel, stored = self._store(digest, data)
+            self._db.execute("INSERT OR REPLACE INTO objects (object, path, stored_bytes) VALUES (?, ?, ?)",
+                             (digest, rel, stored))
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (key, source, url, json.dumps(params or {}, sort_keys=True, default=str),
+                              digest, len(body), now, now))
+            self._db.commit()
+        return digest
+
+    def fetch(self, source, url, params, download, offline=False):
+        """(body, from_cache) for the request, calling `download()` -> bytes on a miss.
+
+        Offline lookups ignore the TTL and raise CacheMiss instead of downloading.
+        """
+        body = self.get(source, url, params, allow_stale=offline)
+        if body is not None:
+            CACHE_REQUESTS.inc(source=source, outcome="hit")
+            return body, True
+        if offline:
+            CACHE_REQUESTS.inc(source=source, outcome="offline_miss")
+            raise CacheMiss(f"{source}: {url} {json.dumps(params, sort_keys=True, default=str)} is not cached")
+        CACHE_REQUESTS.inc(source=source, outcome="miss")
+        body = download()
+        self.put(source, url, params, body)
+        return body, False
+
+    def latest(self, source):
+        """(params, body) of the most recently fetched entry for a source, or None"""
+        with self._lock:
+            row = self._db.execute("SELECT url, params FROM entries WHERE source = ? ORDER BY fetched_at DESC LIMIT 1",
+                                   (source,)).fetchone()
+        if row is None:
+            return None
+        params = json.loads(row[1])
+        return params, self.get(source, row[0], params, allow_stale=True)
+
+    # -- eviction ---------------------------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            entries, raw = self._db.execute("SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0) FROM entries").fetchone()
+            objects, stored = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(stored_bytes), 0) FROM objects").fetchone()
+            expired = self._db.execute("SELECT COUNT(*) FROM entries WHERE fetched_at < ?",
+                                       (time.time() - self.ttl if self.ttl else 0,)).fetchone()[0]
+        return {"entries": entries, "objects": objects, "raw_bytes": raw, "stored_bytes": stored,
+                "expired": expired}
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes; returns entries removed"""
+        with self._lock:
+            removed = 0
+            if self.ttl:
+                removed += self._db.execute("DELETE FROM entries WHERE fetched_at < ?",
+                                            (time.time() - self.ttl,)).rowcount
+            removed += self._drop_unreferenced_and_over_budget()
+            self._db.commit()
+        return removed
+
+    def _drop_unreferenced_and_over_budget(self):
+        self._delete_orphans()
+        if not self.max_bytes:
+            return 0
+        excess = self._db.execute("SELECT COALESCE(SUM(stored_bytes), 0) FROM objects").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return 0
+        # Least recently used first; a shared object only frees space once its last entry goes
+        rows = self._db.execute("SELECT e.key, e.object, o.stored_bytes FROM entries e "
+                                "JOIN objects o ON o.object = e.object ORDER BY e.accessed_at").fetchall()
+        refs = {}
+        for _, digest, _ in rows:
+            refs[digest] = refs.get(digest, 0) + 1
+        victims = []
+        for key, digest, size in rows:
+            victims.append((key,))
+            refs[digest] -= 1
+            if refs[digest] == 0:
+                excess -= size
+                if excess <= 0:
+                    break
+        self._db.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self._delete_orphans()
+        return len(victims)
+
+    def _delete_orphans(self):
+        orphans = self._db.execute(
+            "SELECT object, path FROM objects WHERE object NOT IN (SELECT object FROM entries)").fetchall()
+        for digest, rel in orphans:
+            path = os.path.join(self.root, rel)
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))  # only succeeds once the fan-out directory is empty
+            except OSError:
+                pass
+        self._db.executemany("DELETE FROM objects WHERE object = ?", [(o,) for o, _ in orphans])
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._delete_orphans()
+            self._db.commit()
+
+
+def add_cache_args(ap):
+    ap.add_argument("--cache", metavar="DIR", default=os.environ.get("SOURCE_CACHE_DIR"),
+                    help="cache raw source responses in DIR (default $SOURCE_CACHE_DIR)")
+    ap.add_argument("--cache_ttl", type=float, default=DEFAULT_TTL_HOURS,
+                    help="hours before a cached response is refetched")
+    ap.add_argument("--cache_max_mb", type=float, default=DEFAULT_MAX_MB, help="evict beyond this many MiB")
+    ap.add_argument("--replay", action="store_true",
+                    help="rebuild from the cache only, without the network (needs --cache)")
+
+
+def cache_from_args(args):
+    if args.replay and not args.cache:
+        raise SystemExit("❌ --replay needs --cache DIR (or SOURCE_CACHE_DIR)")
+    if not args.cache:
+        return None
+    return SourceCache(args.cache, ttl_hours=args.cache_ttl, max_mb=args.cache_max_mb)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Inspect or prune the raw source cache")
+    ap.add_argument("command", choices=["stats", "evict", "clear"])
+    add_cache_args(ap)
+    cli = ap.parse_args()
+    if not cli.cache:
+        raise SystemExit("❌ --cache DIR (or SOURCE_CACHE_DIR) is required")
+    cache = SourceCache(cli.cache, ttl_hours=cli.cache_ttl, max_mb=cli.cache_max_mb)
+    if cli.command == "evict":
+        print(f"🧹 Evicted {cache.evict()} entries")
+    elif cli.command == "clear":
+        cache.clear()
+        print("🧹 Cache cleared")
+    st = cache.stats()
+    print(f"📦 {st['entries']} entries, {st['objects']} objects, {st['raw_bytes'] / 2**20:.1f} MiB raw "
+          f"-> {st['stored_bytes'] / 2**20:.1f} MiB stored, {st['expired']} expired")
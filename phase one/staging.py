@@ -0,0 +1,223 @@
+"""
+Staged parcel ingest: load a county into a staging table, validate it, index it, then publish it
+into the live `parcels` table in one transaction.
+
+On SQLite the staging table lives in its own scratch file next to the database
+(`contacts.db.staging-kent-mi.db`, no journal, no fsync), so the bulk load
+never touches the live file or its write lock. On PostgreSQL it is an
+UNLOGGED table in the same database. Indexes are built only after the load.
+
+Publishing swaps the county's rows in a single transaction. It applies only
+the difference: deleted, changed and new parcels. An unchanged reload
+writes almost nothing and holds the write lock briefly. Readers keep
+seeing the old rows until the commit: WAL on SQLite, MVCC on PostgreSQL.
+Parcels that survive a reload keep their `id`, so rows that reference
+parcels stay valid.
+
+    load = StagedLoad("contacts.db", "Ottawa", "MI")
+    load.begin()
+    conn = load.connect(); load.insert(conn, rows); conn.commit(); conn.close()
+    report = load.publish()        # raises ValidationError, live data untouched
+"""
+import os
+import re
+import time
+
+import storage
+from metrics import log_event
+from schema_parcels import PARCEL_COLUMNS, parcel_tuple
+
+KEY = ("county", "state", "parcel_id")
+
+
+class ValidationError(Exception):
+    """The staged load failed its checks; `report` says why and nothing was published"""
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+class StagedLoad:
+    def __init__(self, db, county, state, min_rows=1, max_missing_key=0.01, max_drop=0.2):
+        self.db = db
+        self.county = county
+        self.state = state
+        self.min_rows = min_rows
+        self.max_missing_key = max_missing_key
+        self.max_drop = max_drop
+        self.backend = storage.get_backend(db)
+        slug = re.sub(r"[^a-z0-9]+", "_", f"{county}_{state}".lower()).strip("_")
+        self.table = f"parcels_staging_{slug}"
+        self.staging_path = None if storage.is_postgres(db) else f"{db}.staging-{slug.replace('_', '-')}.db"
+
+    # -- load -----------------------------------------------------------------------------------
+
+    def connect(self):
+        """Connection to write staged rows through (SQLite: the scratch file)"""
+        if self.staging_path is None:
+            return self.backend.connect()
+        conn = storage.get_backend(self.staging_path).connect()
+        conn.execute("PRAGMA journal_mode = OFF")  # scratch data: a crash just means reloading
+        conn.execute("PRAGMA synchronous = OFF")
+        return conn
+
+    def begin(self):
+        """Create an empty, unindexed staging table (dropping any leftover from a failed run)"""
+        self.discard()
+        conn = self.connect()
+        try:
+            if self.staging_path is None:
+                conn.execute(f"CREATE UNLOGGED TABLE {self.table} AS SELECT id, {', '.join(PARCEL_COLUMNS)} "
+                             "FROM parcels WITH NO DATA")
+            else:
+                # Declared types mirror parcels so values keep the same affinity
+                live = self.backend.connect()
+                try:
+                    types = {r["name"]: r["type"] for r in live.execute("PRAGMA table_info(parcels)")}
+                finally:
+                    live.close()
+                cols = ", ".join(f"{c} {types[c]}" for c in ["id"] + PARCEL_COLUMNS)
+                conn.execute(f"CREATE TABLE {self.table} ({cols})")
+            conn.commit()
+        finally:
+            conn.close()
+        self.started = time.perf_counter()
+
+    def insert(self, conn, rows):
+        """Append parcel dicts to the staging table on a connection from `connect()`"""
+        storage.backend_for(conn).bulk_insert(conn, self.table, PARCEL_COLUMNS, [parcel_tuple(r) for r in rows])
+
+    # -- validate, index, publish ---------------------------------------------------------------
+
+    def _prepare(self, conn, t):
+        """Clean and index the staged rows in place; returns counts for the report"""
+        one = lambda sql, params=(): conn.execute(sql, params).fetchone()[0]
+        report = {"county": self.county, "state": self.state, "table": self.table}
+        report["rows_loaded"] = one(f"SELECT COUNT(*) FROM {t}")
+        distinct = "IS NOT" if self.backend.name == "sqlite" else "IS DISTINCT FROM"
+        report["rows_outside"] = one(f"SELECT COUNT(*) FROM {t} WHERE county {distinct} ? OR state {distinct} ?",
+                                     (self.county, self.state))
+        report["missing_key"] = one(f"SELECT COUNT(*) FROM {t} WHERE parcel_id IS NULL OR parcel_id = ''")
+        conn.execute(f"DELETE FROM {t} WHERE parcel_id IS NULL OR parcel_id = ''")
+
+        # Indexes only now that the bulk load is done
+        schema, _, table = t.rpartition(".")
+        conn.execute(f"CREATE INDEX {schema + '.' if schema else ''}idx_{table}_key ON {table} ({', '.join(KEY)})")
+        if self.backend.name == "sqlite":
+            conn.execute(f"DELETE FROM {t} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {t} GROUP BY {', '.join(KEY)})")
+        else:
+            # Keep the last copy of each key; a freshly COPY-loaded heap is in insertion order
+            conn.execute(f"DELETE FROM {t} a USING {t} b WHERE "
+                         + " AND ".join(f"a.{k} = b.{k}" for k in KEY) + " AND a.ctid < b.ctid")
+        report["rows_staged"] = one(f"SELECT COUNT(*) FROM {t}")
+        report["duplicates"] = report["rows_loaded"] - report["missing_key"] - report["rows_staged"]
+        return report
+
+    def _problems(self, report):
+        problems = []
+        if report["rows_outside"]:
+            problems.append(f"{report['rows_outside']} staged rows belong to another county/state")
+        if report["rows_staged"] < self.min_rows:
+            problems.append(f"only {report['rows_staged']} rows staged (minimum {self.min_rows})")
+        if report["rows_loaded"] and report["missing_key"] / report["rows_loaded"] > self.max_missing_key:
+            problems.append(f"{report['missing_key']} of {report['rows_loaded']} rows have no parcel_id")
+        if report["rows_live"] and report["rows_staged"] < report["rows_live"] * (1 - self.max_drop):
+            problems.append(f"row count would drop from {report['rows_live']} to {report['rows_staged']} "
+                            f"(more than {self.max_drop:.0%})")
+        return problems
+
+    def publish(self):
+        """Validate the staged rows and swap them in for the county's live rows atomically.
+
+        Raises ValidationError when a check fails; the live rows are untouched and the staging
+        table is kept for inspection until the next `begin()`.
+        """
+        conn = self.backend.connect()
+        sqlite = self.staging_path is not None
+        t = f"staging.{self.table}" if sqlite else self.table
+        try:
+            if sqlite:
+                # SQLite enforces foreign keys only when asked, per connection: without this, removed
+                # parcels would leave their campaign_contacts rows behind (ON DELETE CASCADE)
+                conn.execute("PRAGMA foreign_keys = ON")
+                conn.execute("ATTACH DATABASE ? AS staging", (self.staging_path,))
+            try:
+                report = self._prepare(conn, t)
+                conn.commit()
+                if sqlite:
+                    conn.execute("BEGIN IMMEDIATE")  # the write lock; readers carry on under WAL
+                report["rows_live"] = conn.execute("SELECT COUNT(*) FROM parcels WHERE county = ? AND state = ?",
+                                                   (self.county, self.state)).fetchone()[0]
+                problems = self._problems(report)
+                if problems:
+                    raise ValidationError(f"staged {self.county}, {self.state} load rejected: "
+                                          + "; ".join(problems), report)
+                report.update(self._swap(conn, t))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                if sqlite:
+                    conn.execute("DETACH DATABASE staging")
+        finally:
+            conn.close()
+        self.discard()
+        report["seconds"] = round(time.perf_counter() - getattr(self, "started", time.perf_counter()), 3)
+        log_event("staging_published", **report)
+        return report
+
+    def _swap(self, conn, t):
+        """Apply the staged county as a diff: only vanished, changed and new parcels are written"""
+        cols = ", ".join(PARCEL_COLUMNS)
+        key_match = " AND ".join(f"p.{k} = s.{k}" for k in KEY)
+        sqlite = self.backend.name == "sqlite"
+        differs = " OR ".join(f"p.{c} IS NOT s.{c}" if sqlite else f"p.{c} IS DISTINCT FROM s.{c}"
+                              for c in PARCEL_COLUMNS)
+        # Surviving parcels keep their ids
+        if sqlite:
+            conn.execute(f"UPDATE {t} AS s SET id = (SELECT p.id FROM main.parcels p WHERE {key_match})")
+        else:
+            conn.execute(f"UPDATE {t} AS s SET id = p.id FROM parcels p WHERE {key_match}")
+        schema, _, table = t.rpartition(".")
+        conn.execute(f"CREATE INDEX {schema + '.' if schema else ''}idx_{table}_id ON {table} (id)")
+        counts = {}
+        counts["deleted"] = conn.execute(
+            f"DELETE FROM parcels WHERE county = ? AND state = ? "
+            f"AND id NOT IN (SELECT id FROM {t} WHERE id IS NOT NULL)", (self.county, self.state)).rowcount
+        if sqlite:
+            counts["updated"] = conn.execute(
+                f"UPDATE parcels SET ({cols}) = (SELECT {cols} FROM {t} s WHERE s.id = parcels.id) "
+                f"WHERE id IN (SELECT s.id FROM {t} s JOIN parcels p ON p.id = s.id WHERE {differs})").rowcount
+        else:
+            counts["updated"] = conn.execute(
+                f"UPDATE parcels p SET {', '.join(f'{c} = s.{c}' for c in PARCEL_COLUMNS)} "
+                f"FROM {t} s WHERE s.id = p.id AND ({differs})").rowcount
+        counts["inserted"] = conn.execute(
+            f"INSERT INTO parcels ({cols}) SELECT {cols} FROM {t} WHERE id IS NULL").rowcount
+        counts["published"] = conn.execute("SELECT COUNT(*) FROM parcels WHERE county = ? AND state = ?",
+                                           (self.county, self.state)).fetchone()[0]
+        return counts
+
+    def discard(self):
+        """Drop the staging table/file (also safe after a failed or abandoned load)"""
+        if self.staging_path is not None:
+            for suffix in ("", "-journal", "-wal", "-shm"):
+                if os.path.exists(self.staging_path + suffix):
+                    os.remove(self.staging_path + suffix)
+            return
+        conn = self.backend.connect()
+        try:
+            conn.execute(f"DROP TABLE IF EXISTS {self.table}")
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def add_staging_args(ap):
+    ap.add_argument("--staging", action="store_true",
+                    help="load into a staging table, validate, then publish atomically")
+    ap.add_argument("--max_drop", type=float, default=0.2,
+                    help="with --staging, reject loads that shrink the county by more than this fraction")
+    ap.add_argument("--min_rows", type=int, default=1, help="with --staging, minimum rows to publish")
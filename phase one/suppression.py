@@ -0,0 +1,317 @@
+"""
+Suppression list: addresses that must never be emailed again (hard bounces, unsubscribes, complaints).
+
+Entries are keyed by the lower-cased address. Campaign building, sends and
+exports all exclude suppressed owners in SQL (`not_suppressed`), an index
+probe per row, so they are never loaded at all.
+
+`ingest` fills the list from the mailbox that bounces and replies land in:
+  * delivery status notifications (RFC 3464 multipart/report) with a failed
+    5.x.x status, and the X-Failed-Recipients header some servers send instead;
+  * abuse feedback reports (ARF), as complaints;
+  * replies whose subject or first line asks to unsubscribe or stop.
+Everything else (soft bounces, ordinary replies) is left alone. The mailbox
+is IMAP, or a local Maildir (handy as a stand-in in development).
+
+    python suppression.py --db contacts.db ingest --maildir ~/Maildir/.Bounces
+    IMAP_PASSWORD=... python suppression.py ingest --imap imap.gmail.com --imap_user me@example.com
+    python suppression.py add someone@example.com
+"""
+import argparse
+import email
+import logging
+import os
+import re
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.utils import getaddresses, parseaddr
+
+import storage
+from metrics import log_event
+
+SUPPRESSIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS suppressions (
+    email TEXT PRIMARY KEY,
+    reason TEXT NOT NULL,
+    source TEXT,
+    detail TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
+"""
+
+
+def create_suppressions(conn, backend):
+    backend.executescript(conn, backend.ddl(SUPPRESSIONS_SCHEMA))
+    if backend.name != "sqlite":
+        # Lookups are only ever by exact address; SQLite has no hash indexes, but there the
+        # table itself is a clustered index on the address
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_suppressions_email_hash ON suppressions USING hash (email)")
+
+
+MIGRATIONS = [
+    ("suppressions_0001_create", create_suppressions),
+]
+
+REASONS = ("bounce", "unsubscribe", "complaint", "manual")
+
+_UNSUBSCRIBE = re.compile(r"^\s*(unsubscribe|stop|remove me|opt[ -]?out)\b", re.IGNORECASE)
+_DAEMON = re.compile(r"^(mailer-daemon|postmaster)@", re.IGNORECASE)
+
+
+def normalize(address):
+    address = (address or "").strip().strip("<>").strip().lower()
+    return address if "@" in address else None
+
+
+def not_suppressed(column):
+    """SQL condition keeping rows whose address in `column` (or a `?` parameter) is not on the list"""
+    return f"NOT EXISTS (SELECT 1 FROM suppressions s WHERE s.email = LOWER({column}))"
+
+
+def suppress(conn, entries, source=None):
+    """Add (address, reason, detail) entries, keeping the first reason recorded; returns how many were new"""
+    rows = {}
+    for address, reason, detail in entries:
+        address = normalize(address)
+        if address and address not in rows:
+            rows[address] = (address, reason, source, detail)
+    if not rows:
+        return 0
+    # rowcount sums over the batch and leaves out the conflicts DO NOTHING skipped
+    return conn.executemany("INSERT INTO suppressions (email, reason, source, detail) VALUES (?, ?, ?, ?) "
+                            "ON CONFLICT (email) DO NOTHING", list(rows.values())).rowcount
+
+
+# -- classifying messages ---------------------------------------------------------------------
+
+def _report_blocks(msg, content_type):
+    """Header blocks of the message/delivery-status (or feedback-report) parts of a report"""
+    for part in msg.walk():
+        if part.get_content_type() != content_type:
+            continue
+        payload = part.get_payload()
+        if isinstance(payload, list):
+            yield from payload
+        elif payload:
+            # Some servers send the status part undecoded; its blocks are blank-line separated headers
+            text = payload if isinstance(payload, str) else payload.decode("utf-8", "replace")
+            for block in re.split(r"\r?\n\r?\n", text.strip()):
+                yield email.message_from_string(block)
+
+
+def _address_field(value):
+    # "rfc822; someone@example.com"
+    return normalize((value or "").split(";", 1)[-1])
+
+
+def _first_line(msg):
+    part = next((p for p in msg.walk() if p.get_content_type() == "text/plain"), None)
+    if part is None:
+        return ""
+    body = part.get_payload(decode=True) or b""
+    try:
+        text = body.decode(part.get_content_charset() or "utf-8", "replace")
+    except LookupError:  # a charset Python does not know, e.g. unknown-8bit
+        text = body.decode("utf-8", "replace")
+    return next((line for line in text.splitlines() if line.strip() and not line.startswith(">")), "")
+
+
+def _subject(msg):
+    """The Subject with RFC 2047 encoded words (=?utf-8?q?...?=) decoded"""
+    raw = str(msg.get("Subject") or "")
+    try:
+        return str(make_header(decode_header(raw)))
+    except (LookupError, UnicodeDecodeError, HeaderParseError):
+        return raw
+
+
+def classify(msg):
+    """[(address, reason, detail)] a message asks to suppress; empty for anything else"""
+    if msg.get_content_type() == "multipart/report":
+        report_type = (msg.get_param("report-type") or "").lower()
+        if report_type == "delivery-status":
+            found = []
+            for block in _report_blocks(msg, "message/delivery-status"):
+                recipient = _address_field(block.get("Final-Recipient") or block.get("Original-Recipient"))
+                status = (block.get("Status") or "").strip()
+                if recipient and (block.get("Action") or "").strip().lower() == "failed" and status.startswith("5"):
+                    found.append((recipient, "bounce", f"{status} {block.get('Diagnostic-Code', '')}".strip()))
+            return found
+        if report_type == "feedback-report":
+            return [(_address_field(block.get("Original-Rcpt-To")), "complaint", block.get("Feedback-Type"))
+                    for block in _report_blocks(msg, "message/feedback-report") if block.get("Original-Rcpt-To")]
+    failed = msg.get_all("X-Failed-Recipients")
+    if failed:
+        return [(address, "bounce", _subject(msg)) for _, address in getaddresses(failed)]
+
+    sender = normalize(parseaddr(msg.get("From", ""))[1])
+    if sender and not _DAEMON.match(sender):
+        subject = _subject(msg)
+        if _UNSUBSCRIBE.match(subject) or _UNSUBSCRIBE.match(_first_line(msg)):
+            return [(sender, "unsubscribe", subject)]
+    return []
+
+
+# -- mailboxes --------------------------------------------------------------------------------
+
+class MaildirInbox:
+    """Unread messages of a local Maildir; processed ones are moved to cur/ and flagged seen.
+
+    The directory is scanned once and files are renamed directly: mailbox.Maildir
+    rescans the whole folder after every move, which is quadratic on a big inbox.
+    """
+
+    def __init__(self, path):
+        if not os.path.isdir(os.path.join(path, "cur")):
+            raise FileNotFoundError(f"{path} is not a Maildir (no cur/ directory)")
+        self.name = f"maildir:{path}"
+        self.path = path
+
+    def messages(self):
+        for subdir in ("new", "cur"):
+            with os.scandir(os.path.join(self.path, subdir)) as entries:
+                names = [e.name for e in entries if e.is_file() and not e.name.startswith(".")]
+            for name in names:
+                _, _, info = name.partition(":2,")
+                if "S" in info:
+                    continue
+                with open(os.path.join(self.path, subdir, name), "rb") as fh:
+                    yield (subdir, name), email.message_from_binary_file(fh)
+
+    def mark_processed(self, key):
+        subdir, name = key
+        base, _, info = name.partition(":2,")
+        flags = "".join(sorted(set(info) | {"S"}))
+        os.rename(os.path.join(self.path, subdir, name), os.path.join(self.path, "cur", f"{base}:2,{flags}"))
+
+    def close(self):
+        pass
+
+
+class ImapInbox:
+    """Unseen messages of an IMAP folder; processed ones are flagged \\Seen"""
+
+    def __init__(self, host, user, password, folder="INBOX", port=993):
+        import imaplib
+        self.name = f"imap:{user}@{host}/{folder}"
+        self.conn = imaplib.IMAP4_SSL(host, port)
+        self.conn.login(user, password)
+        self.conn.select(folder)
+
+    def messages(self):
+        _, data = self.conn.uid("SEARCH", None, "UNSEEN")
+        for uid in data[0].split():
+            _, parts = self.conn.uid("FETCH", uid, "(BODY.PEEK[])")  # PEEK: stays unseen if we crash
+            raw = next((p[1] for p in parts if isinstance(p, tuple)), None)
+            if raw:
+                yield uid, email.message_from_bytes(raw)
+
+    def mark_processed(self, uid):
+        self.conn.uid("STORE", uid, "+FLAGS", r"(\Seen)")
+
+    def close(self):
+        try:
+            self.conn.close()
+        finally:
+            self.conn.logout()
+
+
+def ingest(conn, inbox, batch_size=500):
+    """Suppress everything the inbox's bounces, complaints and unsubscribes name; returns counts.
+
+    Messages are marked processed only after the batch they belong to is committed,
+    so an interrupted run just sees them again (suppressing twice is harmless). A message
+    that cannot be classified is logged, counted as failed and left unread for a look.
+    """
+    counts = {"messages": 0, "bounce": 0, "unsubscribe": 0, "complaint": 0, "ignored": 0, "failed": 0,
+              "added": 0}
+    pending, entries = [], []
+
+    def flush():
+        counts["added"] += suppress(conn, entries, source=inbox.name)
+        conn.commit()
+        for key in pending:
+            inbox.mark_processed(key)
+        pending.clear()
+        entries.clear()
+
+    for key, msg in inbox.messages():
+        counts["messages"] += 1
+        try:
+            found = classify(msg)
+        except Exception as e:
+            counts["failed"] += 1
+            log_event("suppression_message_failed", logging.WARNING, source=inbox.name, key=str(key),
+                      subject=str(msg.get("Subject", ""))[:200], error=f"{type(e).__name__}: {e}")
+            continue
+        if not found:
+            counts["ignored"] += 1
+        for entry in found:
+            counts[entry[1]] += 1
+        entries.extend(found)
+        pending.append(key)
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+    log_event("suppressions_ingested", source=inbox.name, **counts)
+    return counts
+
+
+def ensure_db(db):
+    backend = storage.get_backend(db)
+    conn = backend.connect()
+    try:
+        with backend.schema_lock(conn):
+            storage.apply_migrations(conn, MIGRATIONS)
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Maintain the email suppression list")
+    ap.add_argument("command", choices=["ingest", "add", "list"])
+    ap.add_argument("addresses", nargs="*", help="for add")
+    ap.add_argument("--db", default=os.environ.get("DATABASE_URL") or os.environ.get("DB_FILE", "contacts.db"),
+                    help="SQLite path or postgresql:// URL (default $DATABASE_URL, then $DB_FILE)")
+    ap.add_argument("--reason", choices=REASONS, default="manual", help="for add")
+    ap.add_argument("--maildir", help="ingest from this Maildir")
+    ap.add_argument("--imap", metavar="HOST", default=os.environ.get("IMAP_HOST"), help="ingest over IMAP (SSL)")
+    ap.add_argument("--imap_user", default=os.environ.get("IMAP_USER"))
+    ap.add_argument("--imap_folder", default=os.environ.get("IMAP_FOLDER", "INBOX"))
+    args = ap.parse_args()
+
+    ensure_db(args.db)
+    conn = storage.get_backend(args.db).connect()
+    try:
+        if args.command == "add":
+            added = suppress(conn, [(a, args.reason, None) for a in args.addresses], source="manual")
+            conn.commit()
+            print(f"✅ {added} addresses suppressed")
+        elif args.command == "list":
+            for row in conn.execute("SELECT email, reason, created_at, detail FROM suppressions ORDER BY created_at"):
+                print(f"{row[0]:<40} {row[1]:<12} {row[2]}  {row[3] or ''}")
+        else:
+            if args.maildir:
+                try:
+                    inbox = MaildirInbox(args.maildir)
+                except FileNotFoundError as e:
+                    raise SystemExit(f"❌ {e}")
+            elif args.imap:
+                if not args.imap_user or not os.environ.get("IMAP_PASSWORD"):
+                    raise SystemExit("❌ IMAP needs --imap_user (or IMAP_USER) and IMAP_PASSWORD")
+                inbox = ImapInbox(args.imap, args.imap_user, os.environ["IMAP_PASSWORD"], args.imap_folder)
+            else:
+                raise SystemExit("❌ ingest needs --maildir DIR or --imap HOST")
+            try:
+                counts = ingest(conn, inbox)
+            finally:
+                inbox.close()
+            print(f"✅ {counts['messages']} messages: {counts['bounce']} bounces, {counts['unsubscribe']} unsubscribes, "
+                  f"{counts['complaint']} complaints, {counts['ignored']} ignored, {counts['failed']} failed; "
+                  f"{counts['added']} new suppressions")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
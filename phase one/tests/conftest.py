@@ -0,0 +1,30 @@
+import os
+import uuid
+
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    return str(tmp_path / "contacts.db")
+
+
+@pytest.fixture
+def pg_url():
+    """A PostgreSQL target confined to a throwaway schema of $TEST_PG_URL (skipped when unset)"""
+    url = os.environ.get("TEST_PG_URL")
+    if not url:
+        pytest.skip("set TEST_PG_URL=postgresql://... to run the PostgreSQL tests")
+    pytest.importorskip("psycopg", reason="PostgreSQL tests need psycopg: pip install 'psycopg[binary]'")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = storage.get_backend(url).connect()
+    admin.execute(f"CREATE SCHEMA {schema}")
+    admin.commit()
+    try:
+        yield f"{url}{'&' if '?' in url else '?'}options=-csearch_path%3D{schema}"
+    finally:
+        admin.execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.commit()
+        admin.close()
@@ -0,0 +1,52 @@
+import sqlite3
+
+import pytest
+
+import app as web
+import geo
+
+
+@pytest.mark.parametrize("values", [
+    {"center": [42.96, -85.67], "radius_miles": 1},
+    {"center": "42.96, -85.67", "radius_miles": [1]},
+    {"center": "42.96, -85.67", "radius_miles": True},
+    {"bbox": {"min_lat": 42.9}},
+    {"polygon": 42},
+])
+def test_parse_area_rejects_values_that_are_not_text(values):
+    with pytest.raises(ValueError):
+        geo.parse_area(**values)
+
+
+def test_parse_area_accepts_a_numeric_radius():
+    area = geo.parse_area(center="42.96, -85.67", radius_miles=2)
+    assert area.contains(42.96, -85.67)
+
+
+@pytest.fixture
+def client(sqlite_db):
+    flask_app = web.create_app({"DATABASE": sqlite_db, "TESTING": True})
+    client = flask_app.test_client()
+    client.post("/register", data={"username": "agent", "password": "pw", "confirm_password": "pw"})
+    client.post("/login", data={"username": "agent", "password": "pw"})
+    return client
+
+
+@pytest.mark.parametrize("body", [
+    {"center": [42.96, -85.67], "radius_miles": 1},
+    {"bbox": "42.9, -85.7"},
+    {"state": "MI"},
+])
+def test_create_campaign_needs_a_valid_county_or_area(client, sqlite_db, body):
+    response = client.post("/create_campaign", json=body)
+    assert response.status_code == 400 and not response.get_json()["success"]
+    conn = sqlite3.connect(sqlite_db)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM campaigns").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_search_reports_a_bad_area_as_400(client):
+    assert client.post("/search", data={"state": "MI"}).status_code == 400
+    assert client.post("/search", data={"center": "42.96", "radius_miles": "1"}).status_code == 400
@@ -0,0 +1,159 @@
+"""
+PostgreSQL backend against a live server; every test runs in its own schema.
+
+    TEST_PG_URL=postgresql://postgres@localhost/postgres python -m pytest "phase one/tests"
+"""
+import pytest
+
+import app as web
+import metrics
+import storage
+from schema_parcels import PARCEL_COLUMNS, parcel_tuple, spatial_filter
+from staging import KEY, StagedLoad, ValidationError
+
+
+def parcel(parcel_id, county="Ottawa", lat=None, lon=None, **values):
+    row = dict.fromkeys(PARCEL_COLUMNS)
+    row.update(county=county, state="MI", parcel_id=parcel_id, owner_name=f"OWNER {parcel_id}",
+               assessed_value=100000.0, source="test")
+    if lat is not None:
+        row.update(centroid_lat=lat, centroid_lon=lon, bbox_min_lat=lat - 0.001, bbox_max_lat=lat + 0.001,
+                   bbox_min_lon=lon - 0.001, bbox_max_lon=lon + 0.001)
+    row.update(values)
+    return row
+
+
+@pytest.fixture
+def pg(pg_url):
+    web.init_database(pg_url)
+    conn = storage.get_backend(pg_url).connect()
+    yield conn
+    conn.close()
+
+
+def published(conn, county="Ottawa"):
+    return {r["parcel_id"]: (r["id"], r["owner_name"]) for r in conn.execute(
+        "SELECT id, parcel_id, owner_name FROM parcels WHERE county = ? AND state = 'MI'", (county,))}
+
+
+def test_migrations_apply_once(pg_url, pg):
+    tables = {r[0] for r in pg.execute(
+        "SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()")}
+    assert {"parcels", "users", "campaigns", "campaign_contacts", "suppressions", "schema_migrations"} <= tables
+    indexes = {r[0] for r in pg.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")}
+    assert {"idx_parcels_bbox", "idx_parcels_parcel_key", "idx_suppressions_email_hash"} <= indexes
+    applied = pg.execute("SELECT COUNT(*) FROM schema_migrations").fetchone()[0]
+    web.init_database(pg_url)
+    assert pg.execute("SELECT COUNT(*) FROM schema_migrations").fetchone()[0] == applied
+
+
+def test_placeholders_skip_literals_and_comments(pg):
+    row = pg.execute("SELECT ? AS a, '?' || '%' AS b, 'it''s ?' AS c -- trailing ?\n", ("x",)).fetchone()
+    assert (row["a"], row["b"], row["c"]) == ("x", "?%", "it's ?")
+    pg.executemany("INSERT INTO suppressions (email, reason, detail) VALUES (?, 'manual', '50% off?')",
+                   [("a@example.com",), ("b@example.com",)])
+    assert pg.execute("SELECT COUNT(*) FROM suppressions WHERE detail LIKE '%?'").fetchone()[0] == 2
+
+
+def test_upsert_updates_matches_and_inserts_the_rest(pg):
+    backend = storage.backend_for(pg)
+    update = ["owner_name", "assessed_value"]
+    backend.upsert(pg, "parcels", KEY, PARCEL_COLUMNS, update,
+                   [parcel_tuple(parcel("1")), parcel_tuple(parcel("2"))])
+    pg.commit()
+    ids = published(pg)
+    backend.upsert(pg, "parcels", KEY, PARCEL_COLUMNS, update,
+                   [parcel_tuple(parcel("2", owner_name="NEW OWNER")), parcel_tuple(parcel("3"))])
+    pg.commit()
+    after = published(pg)
+    assert sorted(after) == ["1", "2", "3"]
+    assert after["2"] == (ids["2"][0], "NEW OWNER")
+
+
+def test_upsert_applies_a_repeated_key_once_with_its_last_row(pg):
+    backend = storage.backend_for(pg)
+    update = ["owner_name"]
+    backend.upsert(pg, "parcels", KEY, PARCEL_COLUMNS, update,
+                   [parcel_tuple(parcel("1", owner_name="FIRST")), parcel_tuple(parcel("1", owner_name="LAST"))])
+    backend.upsert(pg, "parcels", KEY, PARCEL_COLUMNS, update,
+                   [parcel_tuple(parcel("1", owner_name="NEWER")), parcel_tuple(parcel("1", owner_name="NEWEST"))])
+    pg.commit()
+    assert [r[0] for r in pg.execute("SELECT owner_name FROM parcels")] == ["NEWEST"]
+
+
+def test_integrity_errors_are_caught_as_storage_integrity_error(pg):
+    pg.execute("INSERT INTO suppressions (email, reason) VALUES ('a@example.com', 'manual')")
+    with pytest.raises(storage.IntegrityError):
+        pg.execute("INSERT INTO suppressions (email, reason) VALUES ('a@example.com', 'manual')")
+    pg.rollback()
+
+
+def test_iter_batches_streams_through_a_named_cursor(pg):
+    backend = storage.backend_for(pg)
+    backend.bulk_insert(pg, "parcels", PARCEL_COLUMNS, [parcel_tuple(parcel(str(i))) for i in range(25)])
+    pg.commit()
+    sizes, cursors = [], set()
+    for batch in backend.iter_batches(pg, "SELECT parcel_id FROM parcels WHERE county = ? ORDER BY id",
+                                      ("Ottawa",), batch_size=10):
+        sizes.append(len(batch))
+        cursors |= {r[0] for r in pg.execute("SELECT name FROM pg_cursors")}
+    assert sizes == [10, 10, 5]
+    assert any(name.startswith("stream_") for name in cursors)
+    # recorded once, like any other statement, when the stream ends
+    before = metrics.SQL_LATENCY.snapshot(statement="SELECT parcels")[0]
+    for _ in backend.iter_batches(pg, "SELECT parcel_id FROM parcels", batch_size=10):
+        pass
+    assert metrics.SQL_LATENCY.snapshot(statement="SELECT parcels")[0] == before + 1
+
+
+def test_spatial_filter_finds_intersecting_parcels(pg):
+    storage.backend_for(pg).bulk_insert(pg, "parcels", PARCEL_COLUMNS, [
+        parcel_tuple(parcel("near", lat=43.0, lon=-85.8)),
+        parcel_tuple(parcel("far", lat=42.5, lon=-86.2)),
+        parcel_tuple(parcel("nowhere")),
+    ])
+    pg.commit()
+    frm, where, params = spatial_filter(storage.backend_for(pg), 42.95, -85.85, 43.05, -85.75)
+    found = [r[0] for r in pg.execute(f"SELECT parcels.parcel_id FROM {frm} WHERE {where}", params)]
+    assert found == ["near"]
+
+
+def test_staged_publish_applies_the_diff_and_keeps_ids(pg_url, pg):
+    load = StagedLoad(pg_url, "Ottawa", "MI")
+    load.begin()
+    conn = load.connect()
+    load.insert(conn, [parcel("1"), parcel("2"), parcel("3")])
+    conn.commit()
+    conn.close()
+    assert load.publish()["inserted"] == 3
+    before = published(pg)
+
+    load.begin()
+    conn = load.connect()
+    load.insert(conn, [parcel("1"), parcel("2", owner_name="SOLD"), parcel("4"), parcel("4")])
+    conn.commit()
+    conn.close()
+    report = load.publish()
+    assert (report["deleted"], report["updated"], report["inserted"], report["duplicates"]) == (1, 1, 1, 1)
+    after = published(pg)
+    assert sorted(after) == ["1", "2", "4"]
+    assert after["1"] == before["1"] and after["2"] == (before["2"][0], "SOLD")
+    tables = {r[0] for r in pg.execute("SELECT tablename FROM pg_tables WHERE schemaname = current_schema()")}
+    assert load.table not in tables
+
+
+def test_rejected_staged_load_leaves_live_rows(pg_url, pg):
+    storage.backend_for(pg).bulk_insert(pg, "parcels", PARCEL_COLUMNS,
+                                        [parcel_tuple(parcel(str(i))) for i in range(10)])
+    pg.commit()
+    before = published(pg)
+    load = StagedLoad(pg_url, "Ottawa", "MI", max_drop=0.2)
+    load.begin()
+    conn = load.connect()
+    load.insert(conn, [parcel("1"), parcel("2", county="Kent")])
+    conn.commit()
+    conn.close()
+    with pytest.raises(ValidationError) as rejected:
+        load.publish()
+    assert rejected.value.report["rows_outside"] == 1
+    assert published(pg) == before
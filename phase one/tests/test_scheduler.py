@@ -0,0 +1,31 @@
+import json
+import os
+
+import pytest
+
+import scheduler
+
+
+def test_relative_database_is_the_one_jobs_load(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    job = scheduler.Job("kent", "etl_kent_mi.py", max_concurrency=2, request_budget_per_minute=60)
+    sched = scheduler.Scheduler("contacts.db", [job])
+    # jobs run from the scripts' directory, so they must be handed the absolute path
+    assert sched.db == str(tmp_path / "contacts.db")
+    cmd = job.command("python", sched.db)
+    assert cmd[cmd.index("--db") + 1] == sched.db
+    assert cmd[-4:] == ["--fetchers", "2", "--max_rpm", "60"]
+
+
+def test_fetch_settings_are_rejected_for_csv_loaders(tmp_path):
+    config = tmp_path / "schedule.json"
+    config.write_text(json.dumps({"counties": [
+        {"name": "ottawa", "script": "etl_ottawa_mi_from_csv.py", "args": ["--csv", "x.csv"], "max_concurrency": 2},
+    ]}))
+    with pytest.raises(SystemExit, match="takes no max_concurrency"):
+        scheduler.load_config(str(config))
+
+
+def test_shipped_schedule_loads():
+    _, jobs = scheduler.load_config(os.path.join(scheduler.HERE, "schedule.json"))
+    assert {job.name for job in jobs} == {"kent", "ottawa"}
@@ -0,0 +1,46 @@
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+import snapshot_parcels  # noqa: E402
+
+
+def parcels(values):
+    schema = snapshot_parcels.arrow_schema()
+    rows = {name: [None] * len(values) for name in schema.names}
+    rows["id"] = list(range(len(values)))
+    rows["assessed_value"], rows["taxable_value"], rows["building_sqft"], rows["year_built"] = map(list, zip(*values))
+    return pa.table(rows, schema=schema).drop_columns(snapshot_parcels.PARTITION_COLUMNS)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    """An Ottawa partition written by hand, sorted by value so each row group covers a narrow range"""
+    values = []
+    for group in range(10):
+        value = 100000.0 * (group + 1)
+        values += [(value, value, 1000.0, 1950)] * 9 + [(None, value + 50000, None, None)]
+    values += [(None, None, 2000.0, 2000)]
+    part = tmp_path / "state=MI" / "county=Ottawa"
+    part.mkdir(parents=True)
+    pq.write_table(parcels(values), part / "part-0.parquet", row_group_size=10)
+    return str(tmp_path)
+
+
+def test_filters_treat_missing_values_like_the_export(snapshot):
+    found = snapshot_parcels.read_snapshot(snapshot, "Ottawa", "MI", max_value=200000)
+    # assessed <= 200k, or no assessed value but taxable <= 200k
+    assert sorted(found["id"]) == list(range(19))
+    # missing square footage and year count as 0
+    assert len(snapshot_parcels.read_snapshot(snapshot, "Ottawa", "MI", max_sqft=500)) == 10
+    assert list(snapshot_parcels.read_snapshot(snapshot, "Ottawa", "MI", min_sqft=1500, year_min=1990)["id"]) == [100]
+
+
+def test_value_filter_prunes_row_groups(snapshot):
+    dataset = snapshot_parcels.ds.dataset(snapshot, format="parquet", partitioning=snapshot_parcels.partitioning())
+    [fragment] = dataset.get_fragments()
+    assert fragment.num_row_groups == 11
+    # Statistics rule out every group whose assessed and taxable values are all above 200k, even
+    # though each has missing assessed values (a coalesce() filter would keep 10 of them)
+    assert len(fragment.split_by_row_group(snapshot_parcels.value_filter(max_value=200000))) == 2
@@ -0,0 +1,46 @@
+import sqlite3
+
+import app as web
+from schema_parcels import PARCEL_COLUMNS
+from staging import StagedLoad
+
+
+def parcel(parcel_id, owner):
+    row = dict.fromkeys(PARCEL_COLUMNS)
+    row.update(county="Ottawa", state="MI", parcel_id=parcel_id, owner_name=owner,
+               situs_address=f"{parcel_id} Main St", assessed_value=100000.0, source="test")
+    return row
+
+
+def publish(db, rows):
+    load = StagedLoad(db, "Ottawa", "MI", max_drop=1)
+    load.begin()
+    conn = load.connect()
+    load.insert(conn, rows)
+    conn.commit()
+    conn.close()
+    return load.publish()
+
+
+def test_publish_drops_removed_parcels_from_campaigns(sqlite_db):
+    flask_app = web.create_app({"DATABASE": sqlite_db, "TESTING": True})
+    publish(sqlite_db, [parcel("1", "JOHN SMITH"), parcel("2", "MARY JONES"), parcel("3", "ANN LEE")])
+    client = flask_app.test_client()
+    client.post("/register", data={"username": "agent", "password": "pw", "confirm_password": "pw"})
+    client.post("/login", data={"username": "agent", "password": "pw"})
+    created = client.post("/create_campaign", json={"county": "Ottawa", "state": "MI", "test_mode": True}).get_json()
+    assert created["contacts_added"] == 3
+
+    assert publish(sqlite_db, [parcel("1", "JOHN SMITH"), parcel("3", "ANN LEE")])["deleted"] == 1
+    conn = sqlite3.connect(sqlite_db)
+    try:
+        # the cascade fired on SQLite too, so no membership row is left pointing at a removed parcel
+        assert conn.execute("SELECT COUNT(*) FROM campaign_contacts").fetchone()[0] == 2
+        # and the list view counts only contacts whose parcel exists, even if an orphan slips in
+        conn.execute("INSERT INTO campaign_contacts (campaign_id, parcel_rowid) VALUES (?, 999)",
+                     (created["campaign_id"],))
+        conn.commit()
+    finally:
+        conn.close()
+    cells = client.get("/campaigns").get_data(as_text=True)
+    assert "<td>2</td>" in cells and "<td>3</td>" not in cells
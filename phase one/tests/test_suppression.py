@@ -0,0 +1,293 @@
+import mailbox
+import os
+import smtplib
+import sqlite3
+
+import pytest
+
+import app as web
+import storage
+import suppression
+from benchmark import StubSMTPServer
+from schema_parcels import PARCEL_COLUMNS, parcel_tuple
+
+DSN = """From: MAILER-DAEMON@mx.example.net
+To: offers@example.com
+Subject: Undelivered Mail Returned to Sender
+MIME-Version: 1.0
+Content-Type: multipart/report; report-type=delivery-status; boundary="b"
+
+--b
+Content-Type: text/plain
+
+This is the mail system at host mx.example.net.
+
+--b
+Content-Type: message/delivery-status
+
+Reporting-MTA: dns; mx.example.net
+
+Final-Recipient: rfc822; {address}
+Action: {action}
+Status: {status}
+Diagnostic-Code: smtp; {status} mailbox unavailable
+
+--b--
+"""
+
+ARF = """From: feedback@isp.example.net
+To: offers@example.com
+Subject: Abuse report
+MIME-Version: 1.0
+Content-Type: multipart/report; report-type=feedback-report; boundary="b"
+
+--b
+Content-Type: text/plain
+
+This is an email abuse report.
+
+--b
+Content-Type: message/feedback-report
+
+Feedback-Type: abuse
+User-Agent: ExampleFBL/1.0
+Version: 1
+Original-Rcpt-To: <Owner@Example.org>
+
+--b--
+"""
+
+X_FAILED = """From: Mail Delivery System <MAILER-DAEMON@mx.example.net>
+To: offers@example.com
+Subject: Mail delivery failed: returning message to sender
+X-Failed-Recipients: gone@example.org, also.gone@example.org
+
+This message was created automatically by mail delivery software.
+"""
+
+
+def reply(sender, subject, body, charset=None):
+    headers = f"From: {sender}\nTo: offers@example.com\nSubject: {subject}\n"
+    if charset:
+        headers += f"MIME-Version: 1.0\nContent-Type: text/plain; charset={charset}\n"
+    return f"{headers}\n{body}\n"
+
+
+CASES = {
+    "hard bounce": (DSN.format(address="Gone@Example.org", action="failed", status="5.1.1"),
+                    [("gone@example.org", "bounce")]),
+    "soft bounce": (DSN.format(address="full@example.org", action="delayed", status="4.2.2"), []),
+    "failed 4.x.x": (DSN.format(address="full@example.org", action="failed", status="4.4.7"), []),
+    "x-failed-recipients": (X_FAILED, [("gone@example.org", "bounce"), ("also.gone@example.org", "bounce")]),
+    "complaint": (ARF, [("owner@example.org", "complaint")]),
+    "unsubscribe subject": (reply("Owner <Owner@Example.org>", "UNSUBSCRIBE", "thanks"),
+                            [("owner@example.org", "unsubscribe")]),
+    "stop first line": (reply("owner@example.org", "Re: Cash Offer", "Stop emailing me\n\n> Dear owner"),
+                        [("owner@example.org", "unsubscribe")]),
+    "quoted unsubscribe": (reply("owner@example.org", "Re: Cash Offer", "Call me\n\n> unsubscribe"), []),
+    "daemon unsubscribe": (reply("MAILER-DAEMON@mx.example.net", "Unsubscribe", "unsubscribe"), []),
+    "ordinary reply": (reply("owner@example.org", "Re: Cash Offer", "Sounds interesting."), []),
+    "encoded subject": (reply("other@example.org", "=?utf-8?q?Unsubscribe_=E2=80=94_thanks?=", "no"),
+                        [("other@example.org", "unsubscribe")]),
+    "unknown charset": (reply("third@example.org", "Re: Cash Offer", "STOP", charset="unknown-8bit"),
+                        [("third@example.org", "unsubscribe")]),
+    "bogus charset": (reply("owner@example.org", "Re: Cash Offer", "Maybe later", charset="x-bogus"), []),
+}
+
+
+@pytest.fixture
+def maildir(tmp_path):
+    """A Maildir stand-in for the bounce inbox; call it with raw messages to deliver them"""
+    path = str(tmp_path / "Maildir")
+    box = mailbox.Maildir(path, create=True)
+
+    def deliver(*messages):
+        for raw in messages:
+            box.add(raw.encode())
+        return path
+
+    return deliver
+
+
+def unread(path):
+    return sorted(os.listdir(os.path.join(path, "new")))
+
+
+def seen(path):
+    return [name for name in os.listdir(os.path.join(path, "cur")) if name.endswith(":2,S")]
+
+
+def suppressed(db):
+    conn = sqlite3.connect(db)  # a separate connection sees only committed rows
+    try:
+        return {row[0]: row[1] for row in conn.execute("SELECT email, reason FROM suppressions")}
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_classify(maildir, case):
+    raw, expected = CASES[case]
+    [(_, msg)] = suppression.MaildirInbox(maildir(raw)).messages()
+    assert [(address, reason) for address, reason, _ in suppression.classify(msg)] == expected
+
+
+def test_ingest_suppresses_and_marks_messages_seen(maildir, sqlite_db):
+    suppression.ensure_db(sqlite_db)
+    path = maildir(*(raw for raw, _ in CASES.values()))
+    conn = sqlite3.connect(sqlite_db)
+    counts = suppression.ingest(conn, suppression.MaildirInbox(path))
+    assert counts == {"messages": len(CASES), "bounce": 3, "unsubscribe": 4, "complaint": 1, "ignored": 6,
+                      "failed": 0, "added": 5}
+    # One entry per address, whichever of its messages came first
+    listed = suppressed(sqlite_db)
+    assert sorted(listed) == ["also.gone@example.org", "gone@example.org", "other@example.org",
+                              "owner@example.org", "third@example.org"]
+    assert listed["other@example.org"] == "unsubscribe"
+    assert listed["gone@example.org"] == "bounce" and listed["owner@example.org"] in ("complaint", "unsubscribe")
+    assert unread(path) == [] and len(seen(path)) == len(CASES)
+    assert suppression.ingest(conn, suppression.MaildirInbox(path))["messages"] == 0
+
+
+class FailingCommit:
+    """A connection whose nth commit fails, as if the process died mid-ingest"""
+
+    def __init__(self, conn, fail_on):
+        self.conn, self.fail_on, self.commits = conn, fail_on, 0
+
+    def commit(self):
+        self.commits += 1
+        if self.commits == self.fail_on:
+            raise sqlite3.OperationalError("disk I/O error")
+        self.conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_ingest_marks_messages_only_after_their_batch_commits(maildir, sqlite_db):
+    suppression.ensure_db(sqlite_db)
+    path = maildir(*(DSN.format(address=f"user{i}@example.org", action="failed", status="5.1.1") for i in range(5)))
+    conn = FailingCommit(sqlite3.connect(sqlite_db), fail_on=2)
+    with pytest.raises(sqlite3.OperationalError):
+        suppression.ingest(conn, suppression.MaildirInbox(path), batch_size=2)
+    # The first batch committed and was marked; the second was neither, so a rerun sees it again
+    assert len(suppressed(sqlite_db)) == 2
+    assert len(seen(path)) == 2 and len(unread(path)) == 3
+    conn.conn.rollback()
+    assert suppression.ingest(conn.conn, suppression.MaildirInbox(path))["added"] == 3
+    assert len(suppressed(sqlite_db)) == 5 and unread(path) == []
+
+
+def test_ingest_skips_a_message_it_cannot_classify(maildir, sqlite_db, monkeypatch):
+    suppression.ensure_db(sqlite_db)
+    path = maildir(*(DSN.format(address=f"user{i}@example.org", action="failed", status="5.1.1") for i in range(3)))
+    classify = suppression.classify
+
+    def flaky(msg):
+        if "user1@" in msg.as_string():
+            raise ValueError("unparseable report")
+        return classify(msg)
+
+    monkeypatch.setattr(suppression, "classify", flaky)
+    counts = suppression.ingest(sqlite3.connect(sqlite_db), suppression.MaildirInbox(path))
+    assert (counts["failed"], counts["added"]) == (1, 2)
+    # the others are recorded and marked; the failed one stays unread to be looked at
+    assert sorted(suppressed(sqlite_db)) == ["user0@example.org", "user2@example.org"]
+    assert len(seen(path)) == 2 and len(unread(path)) == 1
+
+
+def test_suppress_counts_only_new_addresses(sqlite_db):
+    suppression.ensure_db(sqlite_db)
+    conn = sqlite3.connect(sqlite_db)
+    assert suppression.suppress(conn, [("a@example.org", "manual", None), ("B@example.org", "manual", None)]) == 2
+    assert suppression.suppress(conn, [("b@example.org", "bounce", None), ("c@example.org", "bounce", None)]) == 1
+
+
+# -- the web app --------------------------------------------------------------------------------
+
+OWNERS = ["JOHN SMITH", "MARY JONES", "ANN LEE", "BOB BROWN"]
+
+
+@pytest.fixture
+def client(sqlite_db):
+    flask_app = web.create_app({"DATABASE": sqlite_db, "TESTING": True, "SEND_DELAY_SECONDS": 0,
+                                "SMTP_USE_TLS": False, "EMAIL_ADDRESS": "offers@example.com",
+                                "EMAIL_PASSWORD": "pw"})
+    conn = storage.get_backend(sqlite_db).connect()
+    rows = []
+    for i, owner in enumerate(OWNERS):
+        row = dict.fromkeys(PARCEL_COLUMNS)
+        row.update(county="Ottawa", state="MI", parcel_id=f"P{i}", owner_name=owner,
+                   situs_address=f"{i} Main St", assessed_value=100000.0 * (i + 1))
+        rows.append(parcel_tuple(row))
+    storage.backend_for(conn).bulk_insert(conn, "parcels", PARCEL_COLUMNS, rows)
+    conn.commit()
+    conn.close()
+    client = flask_app.test_client()
+    client.post("/register", data={"username": "agent", "password": "pw", "confirm_password": "pw"})
+    client.post("/login", data={"username": "agent", "password": "pw"})
+    return client
+
+
+def campaign(client, db):
+    """A live (non-test) campaign over every parcel; test mode makes the found addresses predictable"""
+    created = client.post("/create_campaign", json={"county": "Ottawa", "state": "MI", "test_mode": True}).get_json()
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE campaigns SET test_mode = FALSE WHERE id = ?", (created["campaign_id"],))
+    conn.commit()
+    conn.close()
+    return created
+
+
+def sent_flags(db, campaign_id):
+    conn = sqlite3.connect(db)
+    try:
+        return dict(conn.execute("SELECT email, email_sent FROM campaign_contacts WHERE campaign_id = ?",
+                                 (campaign_id,)).fetchall())
+    finally:
+        conn.close()
+
+
+def test_campaigns_leave_out_suppressed_owners(client, sqlite_db):
+    conn = sqlite3.connect(sqlite_db)
+    suppression.suppress(conn, [("Test.John.Smith@example.com", "unsubscribe", None)])
+    conn.commit()
+    conn.close()
+    created = campaign(client, sqlite_db)
+    assert (created["contacts_added"], created["emails_suppressed"]) == (3, 1)
+    assert "test.john.smith@example.com" not in sent_flags(sqlite_db, created["campaign_id"])
+    assert b"Smith" not in client.get(f"/export/{created['campaign_id']}").data
+
+
+def test_send_skips_suppressed_and_suppresses_refused(client, sqlite_db):
+    created = campaign(client, sqlite_db)
+    conn = sqlite3.connect(sqlite_db)
+    suppression.suppress(conn, [("test.mary.jones@example.com", "bounce", None)])  # after the campaign was built
+    conn.commit()
+    conn.close()
+    with StubSMTPServer(reject=["test.ann.lee@example.com"]) as smtp:
+        client.application.config.update(SMTP_SERVER="127.0.0.1", SMTP_PORT=smtp.port)
+        result = client.post(f"/send_emails/{created['campaign_id']}").get_json()
+    assert result["emails_sent"] == 2 and smtp.messages == 2
+    assert sent_flags(sqlite_db, created["campaign_id"]) == {
+        "test.john.smith@example.com": 1, "test.mary.jones@example.com": 0,
+        "test.ann.lee@example.com": 0, "test.bob.brown@example.com": 1}
+    assert suppressed(sqlite_db)["test.ann.lee@example.com"] == "bounce"
+
+
+def test_send_keeps_progress_when_the_connection_fails(client, sqlite_db, monkeypatch):
+    created = campaign(client, sqlite_db)
+
+    def dropped(self):
+        raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+    monkeypatch.setattr(smtplib.SMTP, "quit", dropped)
+    with StubSMTPServer(reject=["test.ann.lee@example.com"]) as smtp:
+        client.application.config.update(SMTP_SERVER="127.0.0.1", SMTP_PORT=smtp.port)
+        result = client.post(f"/send_emails/{created['campaign_id']}").get_json()
+    assert not result["success"] and result["emails_sent"] == 3
+    # Delivered flags and the refused address survive the request's rollback, so nothing is re-sent
+    flags = sent_flags(sqlite_db, created["campaign_id"])
+    assert sum(flags.values()) == 3 and flags["test.ann.lee@example.com"] == 0
+    assert "test.ann.lee@example.com" in suppressed(sqlite_db)